@@ -0,0 +1,259 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, utils
+from .suffix import Suffix
+
+import json
+import math
+import queue
+import struct
+import threading
+import time
+import subprocess as sp
+
+from collections import OrderedDict
+
+# Every frame is a one byte type and a four byte payload length followed
+# by the payload. The controller writes bare 8 byte timestamps to the
+# agent's stdin to ask for the agent's time.
+FRAME_HELLO = b"H"     # JSON: host name and the column titles
+FRAME_SAMPLE = b"S"    # timestamp followed by one double per column
+FRAME_TIME = b"T"      # echoed controller timestamp and agent timestamp
+
+frame_hdr = struct.Struct("!cI")
+ping_fmt = struct.Struct("!d")
+time_fmt = struct.Struct("!dd")
+
+class AgentException(Exception):
+    pass
+
+class FrameWriter(object):
+    def __init__(self, f):
+        self.f = f
+        self.lock = threading.Lock()
+
+    def write(self, typ, payload):
+        with self.lock:
+            self.f.write(frame_hdr.pack(typ, len(payload)) + payload)
+            self.f.flush()
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise EOFError()
+    return data
+
+def read_frame(f):
+    typ, length = frame_hdr.unpack(_read_exact(f, frame_hdr.size))
+    return typ, _read_exact(f, length)
+
+def _serve_pings(inp, writer, stopped):
+    try:
+        while True:
+            data = _read_exact(inp, ping_fmt.size)
+            writer.write(FRAME_TIME, data + ping_fmt.pack(time.time()))
+    except (EOFError, OSError):
+        pass
+
+    stopped.set()
+
+def run_agent(timelines, host, out, inp):
+    """Sample the timelines forever, streaming each sample to out until
+    the controller closes inp."""
+
+    writer = FrameWriter(out)
+    stopped = threading.Event()
+
+    threading.Thread(target=_serve_pings, args=(inp, writer, stopped),
+                     daemon=True).start()
+
+    fmt = None
+    while not stopped.is_set():
+        for tl in timelines:
+            tl.wait_until_ready()
+        for tl in timelines:
+            tl.next()
+
+        values = [float(x) for tl in timelines for x in tl.csv()]
+
+        if fmt is None:
+            titles = [t for tl in timelines for t in tl.csv_titles()]
+            fmt = struct.Struct("!{}d".format(len(values) + 1))
+            writer.write(FRAME_HELLO, json.dumps({"host": host,
+                                                  "titles": titles}).encode())
+
+        try:
+            writer.write(FRAME_SAMPLE, fmt.pack(time.time(), *values))
+        except BrokenPipeError:
+            break
+
+byte_names = ("tx", "rx", "read", "write", "ingress", "egress", "volume",
+              "mem_used", "size", "used")
+
+# Rates of these are in bytes per second, every other _rate column
+# counts events (interrupts, softirqs, packets, page faults) per second
+byte_rate_names = byte_names + ("alloc", "copy", "numa_hit", "numa_miss",
+                                "numa_foreign", "local_node", "other_node")
+
+def format_value(title, value):
+    name = title.rsplit(":", 1)[-1]
+
+    # Timelines record NaN for values they couldn't read
+    if math.isnan(value):
+        return "-"
+    if name.endswith("_pct"):
+        return "{:.1%}".format(value)
+    if name.endswith("io_rate"):
+        return "{:.1f}".format(Suffix(value, unit="IOPS/s", decimal=True))
+    if name.endswith("_rate"):
+        if name[:-len("_rate")] in byte_rate_names:
+            return "{:.1f}".format(Suffix(value, unit="B/s"))
+        return "{:.1f}".format(Suffix(value, unit="/s", decimal=True))
+    if name in byte_names:
+        return "{:.1f}".format(Suffix(value))
+    if value == int(value):
+        return "{:d}".format(int(value))
+    return "{:.2f}".format(value)
+
+class RemoteTimeline(utils.Timeline):
+    """Timeline fed by an agent running the timelines on another host
+    (or locally as a subprocess). The agent's sample times are corrected
+    by the clock offset measured when connecting."""
+
+    per_line = 3
+
+    def __init__(self, host, command, sync_count=8, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.host = host
+        self.command = command
+        self.sync_count = sync_count
+        self.titles = None
+        self.hello = threading.Event()
+        self.new_sample = threading.Event()
+        self.sample = None
+        self.eof = False
+        self.times = queue.Queue()
+        self.offset = 0
+        self.rtt = None
+        self.latest = None
+
+    def _read_frames(self):
+        try:
+            while True:
+                typ, payload = read_frame(self.p.stdout)
+
+                if typ == FRAME_HELLO:
+                    hello = json.loads(payload.decode())
+                    self.titles = hello["titles"]
+                    self.remote_host = hello["host"]
+                    self.fmt = struct.Struct("!{}d".format(len(self.titles) + 1))
+                    self.hello.set()
+                elif typ == FRAME_SAMPLE:
+                    self.sample = self.fmt.unpack(payload)
+                    self.new_sample.set()
+                elif typ == FRAME_TIME:
+                    self.times.put((time_fmt.unpack(payload), time.time()))
+        except (EOFError, OSError):
+            pass
+
+        self.eof = True
+        self.new_sample.set()
+
+    def sync_clock(self):
+        exchanges = []
+        for i in range(self.sync_count):
+            self.p.stdin.write(ping_fmt.pack(time.time()))
+            self.p.stdin.flush()
+
+            try:
+                (t0, remote), t1 = self.times.get(timeout=10)
+            except queue.Empty:
+                raise AgentException("No response from agent on {}".
+                                     format(self.host))
+            exchanges.append((t0, remote, t1))
+
+        self.offset, self.rtt = utils.estimate_clock_offset(exchanges)
+
+    def __enter__(self):
+        self.p = sp.Popen(self.command, stdin=sp.PIPE, stdout=sp.PIPE)
+        threading.Thread(target=self._read_frames, daemon=True).start()
+
+        try:
+            self.sync_clock()
+            if not self.hello.wait(max(10, self.period * 5)):
+                raise AgentException("Timed out waiting for agent on {}".
+                                     format(self.host))
+        except:
+            self.__exit__(None, None, None)
+            raise
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            self.p.stdin.close()
+        except OSError:
+            pass
+
+        try:
+            self.p.wait(5)
+        except sp.TimeoutExpired:
+            self.p.kill()
+            self.p.wait()
+
+    def wait_until_ready(self):
+        self.new_sample.wait()
+        if self.eof:
+            raise AgentException("Agent on {} exited".format(self.host))
+
+    def next(self):
+        super().next()
+
+        self.wait_until_ready()
+        self.new_sample.clear()
+        sample = self.sample
+
+        self.latest = (sample[0] - self.offset, ) + tuple(sample[1:])
+
+        return OrderedDict(zip(self.titles, sample[1:]))
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}Remote {} (clock offset {:+.3f}s, rtt {:.3f}s):{c.rst}".
+              format(indent, self.host, self.offset, self.rtt, c=colours))
+        indent += "  "
+
+        groups = OrderedDict()
+        for title, value in stats.items():
+            group, _, name = title.rpartition(":")
+            groups.setdefault(group, []).append(
+                "{:<14} {:>14}".format(name + ":", format_value(title, value)))
+
+        for group, vals in groups.items():
+            for i in range(0, len(vals), self.per_line):
+                print("{}{:<30} {}".format(indent, group if not i else "",
+                                           "  ".join(vals[i:i+self.per_line])))
+
+    def csv(self):
+        return (self.latest[0], self.offset) + self.latest[1:]
+
+    def csv_titles(self):
+        return (["{}:timestamp".format(self.host),
+                 "{}:clock_offset".format(self.host)] +
+                ["{}:{}".format(self.host, t) for t in self.titles])
@@ -0,0 +1,97 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+import os
+import json
+import time
+import hashlib
+import platform
+import tempfile
+
+default_path = os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                           os.path.expanduser("~/.cache")),
+                            "nvmeof-perf")
+
+def host_identity():
+    uname = platform.uname()
+    return {"host": uname.node,
+            "kernel": uname.release,
+            "kernel_version": uname.version,
+            "machine": uname.machine}
+
+class ResultsCache(object):
+    """Store of completed test results, one JSON file per configuration.
+    The host and kernel identity are always added to the configuration
+    so results never carry over between machines or kernel updates."""
+
+    def __init__(self, path=default_path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _config(self, config):
+        ret = dict(config)
+        ret.update(host_identity())
+        return ret
+
+    def _fname(self, config):
+        data = json.dumps(self._config(config), sort_keys=True)
+        key = hashlib.sha1(data.encode()).hexdigest()
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, config):
+        try:
+            with open(self._fname(config)) as f:
+                return json.load(f)["results"]
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def put(self, config, results):
+        data = {"config": self._config(config),
+                "time": time.time(),
+                "results": results}
+
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp, self._fname(config))
+        except:
+            os.unlink(tmp)
+            raise
+
+def run_point(run, keys, trial=0, cache=None, force=False, tool=None,
+              **kwargs):
+    """Return the result of run(**kwargs) for one trial of a test,
+    taken from the cache when it already holds one for the same values
+    of the given keyword arguments (and tool) unless forced to rerun."""
+
+    config = {k: kwargs.get(k) for k in keys}
+    if tool:
+        config["tool"] = tool
+    config["trial"] = trial
+
+    if cache and not force:
+        res = cache.get(config)
+        if res is not None:
+            print("  Using cached result for trial {}".format(trial + 1))
+            return res
+
+    res = run(**kwargs)
+
+    if cache:
+        cache.put(config, res)
+
+    return res
@@ -17,11 +17,15 @@
 
 import curses
 
-curses.setupterm()
+try:
+    curses.setupterm()
 
-bold = curses.tigetstr("bold") or b""
-setaf = curses.tigetstr("setaf") or b""
-rst = curses.tigetstr("sgr0") or b""
+    bold = curses.tigetstr("bold") or b""
+    setaf = curses.tigetstr("setaf") or b""
+    rst = curses.tigetstr("sgr0") or b""
+except curses.error:
+    # No terminal, eg. when run as a remote agent over ssh
+    bold = setaf = rst = b""
 
 if setaf:
     green = curses.tparm(setaf, curses.COLOR_GREEN) or b""
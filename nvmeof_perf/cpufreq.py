@@ -0,0 +1,312 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, likwid, topology, utils
+
+import os
+import re
+import math
+import struct
+
+from collections import OrderedDict
+
+cpu_dir = "/sys/devices/system/cpu"
+
+class CpuFreqException(Exception):
+    pass
+
+MSR_IA32_MPERF = 0xe7
+MSR_IA32_APERF = 0xe8
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+def online_cpus():
+    return topology.parse_cpulist(_read(os.path.join(cpu_dir, "online")))
+
+def base_frequency():
+    """Return the CPU's base (TSC) frequency in Hz, which MPERF counts
+    at, or None if it can't be found."""
+
+    try:
+        return int(_read(os.path.join(cpu_dir, "cpu0", "cpufreq",
+                                      "base_frequency"))) * 1e3
+    except (IOError, ValueError):
+        pass
+
+    # Intel model names end in the base frequency, eg. "@ 2.10GHz"
+    with open("/proc/cpuinfo") as f:
+        for l in f:
+            m = re.search(r"@\s*([0-9.]+)GHz", l)
+            if l.startswith("model name") and m:
+                return float(m.group(1)) * 1e9
+
+    return None
+
+def likwid_order(cpus):
+    """Sort CPUs in likwid's order: the first thread of every core and
+    then the second."""
+
+    def thread(cpu):
+        path = os.path.join(cpu_dir, "cpu{}".format(cpu), "topology",
+                            "thread_siblings_list")
+        try:
+            return topology.parse_cpulist(_read(path)).index(cpu)
+        except (IOError, ValueError):
+            return 0
+
+    return sorted(cpus, key=lambda c: (thread(c), c))
+
+def socket_cpus(socket, cpus):
+    return likwid_order(c for c in cpus if likwid.cpu_socket(c) == socket)
+
+def _parse_list(expr, text):
+    try:
+        return topology.parse_cpulist(text)
+    except ValueError:
+        raise CpuFreqException("Invalid CPU list in '{}'".format(expr))
+
+def resolve_cpus(exprs):
+    """Turn CPU lists (eg. '0-3,8') and likwid expressions for the
+    socket (eg. 'S0:1' or 'S1:0-3', as the test processes are pinned
+    with) or node ('N:0,2') domains into CPU numbers. Expressions may
+    be joined with '@'."""
+
+    cpus = online_cpus()
+    ret = []
+    for expr in exprs:
+        for e in str(expr).split("@"):
+            m = re.match(r"^(?:S([0-9]+)|(N)):(.*)$", e)
+            if not m:
+                if ":" in e:
+                    raise CpuFreqException("Unsupported likwid CPU "
+                                           "expression '{}'".format(e))
+                found = _parse_list(e, e)
+                missing = [c for c in found if c not in cpus]
+                if missing:
+                    raise CpuFreqException("CPU {} in '{}' is not online".
+                                           format(missing[0], e))
+                ret += found
+                continue
+
+            domain = (likwid_order(cpus) if m.group(2) else
+                      socket_cpus(int(m.group(1)), cpus))
+            for i in _parse_list(e, m.group(3)):
+                if i >= len(domain):
+                    raise CpuFreqException("'{}' is past the {} CPUs of "
+                                           "its domain".format(e,
+                                                               len(domain)))
+                ret.append(domain[i])
+
+    return ret
+
+class Msr(object):
+    def __init__(self, cpu):
+        self.fd = os.open("/dev/cpu/{}/msr".format(cpu), os.O_RDONLY)
+
+    def read(self, reg):
+        return struct.unpack("<Q", os.pread(self.fd, 8, reg))[0]
+
+    def close(self):
+        os.close(self.fd)
+
+class IdleState(object):
+    def __init__(self, path):
+        self.path = path
+        self.name = _read(os.path.join(path, "name"))
+        self.latency = int(_read(os.path.join(path, "latency")))
+
+    def read(self):
+        return (int(_read(os.path.join(self.path, "time"))) * 1e-6,
+                int(_read(os.path.join(self.path, "usage"))))
+
+def idle_states(cpu):
+    path = os.path.join(cpu_dir, "cpu{}".format(cpu), "cpuidle")
+    try:
+        names = sorted((d for d in os.listdir(path) if d.startswith("state")),
+                       key=lambda d: int(d[5:]))
+    except OSError:
+        return []
+
+    return [IdleState(os.path.join(path, n)) for n in names]
+
+class CpuFreqTimeline(utils.Timeline):
+    """Frequency and idle state residency of the CPUs, averaged over
+    each socket and over the CPUs a test is pinned to.
+
+    The frequency is the average while busy from the APERF/MPERF MSRs
+    when /dev/cpu/N/msr can be read (the msr module, as root), along
+    with the fraction of time busy, and otherwise the cpufreq driver's
+    scaling_cur_freq. For each idle state the fraction of time spent in
+    it and the number of times it was entered are recorded. Deep states
+    on the cores taking completions add their exit latency to every
+    IO."""
+
+    def __init__(self, cpus=[], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.cpus = online_cpus()
+        self.states = {c: idle_states(c) for c in self.cpus}
+        self.base = base_frequency()
+
+        self.msrs = {}
+        if self.base:
+            try:
+                for c in self.cpus:
+                    self.msrs[c] = Msr(c)
+            except OSError:
+                self.close_msrs()
+
+        self.groups = OrderedDict()
+        for c in self.cpus:
+            try:
+                s = likwid.cpu_socket(c)
+            except (IOError, ValueError):
+                s = 0
+            self.groups.setdefault("socket{}".format(s), []).append(c)
+
+        if cpus:
+            self.groups["pinned"] = resolve_cpus(cpus)
+
+        self.last = None
+
+    def close_msrs(self):
+        for m in self.msrs.values():
+            m.close()
+        self.msrs = {}
+
+    def __exit__(self, *args):
+        self.close_msrs()
+        return super().__exit__(*args)
+
+    def _read_cpu(self, cpu):
+        ret = {}
+        if self.msrs:
+            m = self.msrs[cpu]
+            ret["aperf"] = m.read(MSR_IA32_APERF)
+            ret["mperf"] = m.read(MSR_IA32_MPERF)
+        else:
+            path = os.path.join(cpu_dir, "cpu{}".format(cpu), "cpufreq",
+                                "scaling_cur_freq")
+            try:
+                ret["freq"] = int(_read(path)) * 1e3
+            except (IOError, ValueError):
+                ret["freq"] = math.nan
+
+        ret["idle"] = [s.read() for s in self.states[cpu]]
+        return ret
+
+    def _cpu_stats(self, new, old):
+        ret = {}
+        if self.msrs:
+            aperf = new["aperf"] - old["aperf"]
+            mperf = new["mperf"] - old["mperf"]
+            ret["freq"] = self.base * aperf / mperf if mperf else math.nan
+            ret["busy"] = (mperf / (self.base * self.duration)
+                           if self.duration else math.nan)
+        else:
+            ret["freq"] = new["freq"]
+
+        ret["idle"] = [(t - ot, u - ou) for (t, u), (ot, ou) in
+                       zip(new["idle"], old["idle"])]
+        return ret
+
+    def next(self):
+        super().next()
+
+        stats_new = {c: self._read_cpu(c) for c in self.cpus}
+        stats = {c: self._cpu_stats(s, (self.last or stats_new)[c])
+                 for c, s in stats_new.items()}
+        self.last = stats_new
+
+        def mean(values):
+            values = [v for v in values if not math.isnan(v)]
+            return sum(values) / len(values) if values else math.nan
+
+        def rate(x):
+            return x / self.duration if self.duration else 0
+
+        ret = OrderedDict()
+        for name, cpus in self.groups.items():
+            cpus = [c for c in cpus if c in stats]
+            freqs = [stats[c]["freq"] for c in cpus
+                     if not math.isnan(stats[c]["freq"])]
+
+            g = OrderedDict()
+            g["freq_mhz"] = mean(freqs) / 1e6
+            g["min_freq_mhz"] = min(freqs, default=math.nan) / 1e6
+            g["max_freq_mhz"] = max(freqs, default=math.nan) / 1e6
+            if self.msrs:
+                g["busy_pct"] = mean(stats[c]["busy"] for c in cpus)
+
+            for i, st in enumerate(self.states[cpus[0]] if cpus else []):
+                idle = [stats[c]["idle"][i] for c in cpus
+                        if i < len(stats[c]["idle"])]
+                g[st.name + "_pct"] = mean(rate(t) for t, u in idle)
+                g[st.name + "_entry_rate"] = rate(sum(u for t, u in idle))
+
+            ret[name] = g
+
+        self.latest = ret
+        return ret
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}CPU Frequency{}:{c.rst}".
+              format(indent, " (APERF/MPERF)" if self.msrs else "",
+                     c=colours))
+        indent += "  "
+
+        def mhz(x):
+            return "-" if math.isnan(x) else "{:.0f}".format(x)
+
+        for name, g in stats.items():
+            spread = ("  \t{}-{} MHz".format(mhz(g["min_freq_mhz"]),
+                                              mhz(g["max_freq_mhz"]))
+                      if not math.isnan(g["min_freq_mhz"]) else "")
+            print("{}{:<30} freq:  {:>7} MHz{}".
+                  format(indent, name, mhz(g["freq_mhz"]), spread))
+            if "busy_pct" in g:
+                print("{}{:<30} busy:  {:>7.1%}".format(indent, "",
+                                                         g["busy_pct"]))
+
+            cpu = self.groups[name][0]
+            for st in self.states.get(cpu, []):
+                print("{}  {:<28} {:>7.1%}  \t{:>9.0f}/s  (exit {} us)".
+                      format(indent, st.name + ":", g[st.name + "_pct"],
+                             g[st.name + "_entry_rate"],
+                             st.latency))
+
+    def csv(self):
+        return tuple(x for y in self.latest.values() for x in y.values())
+
+    def csv_titles(self):
+        return tuple("{}:{}".format(n, x) for n, y in self.latest.items()
+                     for x in y.keys())
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    tl = CpuFreqTimeline(period=2.0, cpus=sys.argv[1:])
+
+    while True:
+        print(time.asctime())
+        tl.print_next();
+        print()
+        print()
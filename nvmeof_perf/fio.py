@@ -15,24 +15,171 @@
 ##
 ########################################################################
 
-from . import likwid, proc, suffix
+from . import colours, likwid, proc, ssh, utils
+from .suffix import Suffix
 
-import re
+import json
 import threading
 
+from collections import OrderedDict
+
+# Completion latency percentiles reported for every test, all of these
+# are in fio's default percentile_list
+report_percentiles = [50, 90, 99, 99.9, 99.99]
+
+def percentile_name(pct):
+    return "p{:g}".format(pct)
+
+def hist_percentiles(hist, percentiles=report_percentiles):
+    """Return the given percentiles of a histogram held as a list of
+    (value, count) pairs sorted by value."""
+
+    total = sum(c for v, c in hist)
+    ret = OrderedDict()
+    if not total:
+        return ret
+
+    for pct in percentiles:
+        need = total * pct / 100
+        cum = 0
+        for v, c in hist:
+            cum += c
+            if cum >= need:
+                break
+        ret[percentile_name(pct)] = v
+
+    return ret
+
+def merge_hists(hists):
+    ret = {}
+    for h in hists:
+        for v, c in h or []:
+            ret[v] = ret.get(v, 0) + c
+
+    return sorted(ret.items())
+
+def _pooled(stats):
+    """Combine the mean and standard deviation of several fio latency
+    blocks (weighted by their sample counts) into one, in microseconds."""
+
+    stats = [(s["N"], s["mean"], s["stddev"], s["min"], s["max"])
+             for s in stats if s.get("N")]
+    if not stats:
+        return None
+
+    n = sum(x[0] for x in stats)
+    mean = sum(x[0] * x[1] for x in stats) / n
+    var = sum(x[0] * (x[2]**2 + x[1]**2) for x in stats) / n - mean**2
+
+    return {"avg": mean / 1e3,
+            "min": min(x[3] for x in stats) / 1e3,
+            "max": max(x[4] for x in stats) / 1e3,
+            "stdev": max(var, 0)**0.5 / 1e3}
+
+def parse_json(data):
+    """Summarize the json+ output of a fio run: the bandwidth, IOPS and
+    volume of every job summed together, the IOPS of each job, the total
+    latency and submission latency and the completion latency
+    percentiles taken from the combined histogram. Latencies are in
+    microseconds."""
+
+    jobs = [[job[d] for d in ("read", "write", "trim")
+             if job.get(d, {}).get("io_bytes")]
+            for job in data.get("jobs", [])]
+    jobs = [j for j in jobs if j]
+    ddirs = [d for j in jobs for d in j]
+    if not ddirs:
+        return None
+
+    hist = merge_hists([(int(ns) / 1e3, c) for ns, c in
+                        d["clat_ns"].get("bins", {}).items()]
+                       for d in ddirs)
+
+    lat = _pooled([d["lat_ns"] for d in ddirs])
+    slat = _pooled([d["slat_ns"] for d in ddirs])
+    clat = _pooled([d["clat_ns"] for d in ddirs])
+    if lat is not None:
+        if slat is not None:
+            lat["slat_avg"] = slat["avg"]
+        if clat is not None:
+            lat["clat_avg"] = clat["avg"]
+        lat.update(hist_percentiles(hist))
+
+    return {"bandwidth": sum(d["bw_bytes"] for d in ddirs),
+            "iops": sum(d["iops"] for d in ddirs),
+            "iops_per_job": [sum(d["iops"] for d in j) for j in jobs],
+            "ios": sum(d["total_ios"] for d in ddirs),
+            "volume": sum(d["io_bytes"] for d in ddirs),
+            "latency": lat,
+            "histogram": hist}
+
 class FioRunner(proc.ProcRunner):
-    def __init__(self, test_args=[], **kwargs):
-        self.exe = ["fio", "-"]
+    # Job sections that follow the main job and the extra job lines
+    sections = ""
+
+    def __init__(self, test_args=[], status_interval=None, **kwargs):
+        # The status lines are still needed to see when the test starts
+        # so force them on with the json output
+        self.exe = ["fio", "--output-format=json+", "--eta=always", "-"]
+
+        # fio dumps the cumulative stats as another json object every
+        # status_interval seconds, the last one seen is kept in status
+        if status_interval:
+            self.exe.insert(-1, "--status-interval={}ms".
+                            format(int(status_interval * 1000)))
 
         self.extra_job_lines = "\n".join(test_args)
+        self.json_lines = None
+        self.stats = None
+        self.status = None
         super(FioRunner, self).__init__(**kwargs)
 
+    def process_line(self, line):
+        super(FioRunner, self).process_line(line)
+
+        if self.json_lines is None:
+            if line.startswith("{"):
+                self.json_lines = [line]
+        else:
+            self.json_lines.append(line)
+            if line.startswith("}"):
+                data = json.loads("".join(self.json_lines))
+                self.json_lines = None
+                self.process_json(data)
+
+    def process_json(self, data):
+        self.status = data
+        self.stats = parse_json(data)
+
+    def _stat(self, name):
+        if self.stats is None:
+            return None
+        return self.stats[name]
+
+    def bandwidth(self):
+        return self._stat("bandwidth")
+
+    def iops(self):
+        return self._stat("iops")
+
+    def iops_per_job(self):
+        return self._stat("iops_per_job")
+
+    def latency(self):
+        return self._stat("latency")
+
+    def latency_histogram(self):
+        return self._stat("histogram")
+
+    def volume(self):
+        return self._stat("volume")
+
     def setup(self):
         opts = dict(self.__class__.__dict__)
         opts.update(self.__dict__)
 
         job = self.job.format(**opts)
-        job = job + "\n" + self.extra_job_lines
+        job = job + "\n" + self.extra_job_lines + self.sections
 
         if self.log_file:
             print("\n", file=self.log_file)
@@ -51,19 +198,21 @@ class FioServer(FioRunner):
     job = """[rdma-server]
              rw=read
              ioengine=rdma
-             port=11692
+             port={port}
              bs={block_size}
              size={size}"""
 
     mbw_stats = {}
 
     def __init__(self, command=None, block_size=1<<20, size=100<<40,
-                 duration=None,  mbw=None, mmap=None, **kwargs):
+                 duration=None,  mbw=None, mmap=None, port=None, **kwargs):
+        self.port = port or 11692
         self.block_size = block_size
         if self.block_size < 4096: self.block_size = 4096
         self.size = size
         self.mbw = mbw
         self.mbw_started = False
+        self.measuring = False
         self.mmap = mmap
         if self.mmap is not None:
             self.job += "\nmem=mmapshared:{mmap}"
@@ -76,14 +225,24 @@ class FioServer(FioRunner):
         super(FioServer, self).process_line(line)
 
         if "waiting for connection" in line:
+            self.mark_phase("server_ready")
             self.ready.set()
-        elif (self.mbw is not None and not self.mbw_started and
-              line.startswith("Jobs")):
-            self.mbw.clear()
-            self.mbw_started = True
-        elif self.mbw_started and line.startswith("rdma-server"):
-            self.mbw_stats = self.mbw.stats()
-            self.mbw_started = False
+        elif not self.measuring and line.startswith("Jobs"):
+            self.mark_phase("measurement_start")
+            self.measuring = True
+            if self.mbw is not None:
+                self.mbw.clear()
+                self.mbw_started = True
+
+    def process_json(self, data):
+        if self.measuring:
+            self.mark_phase("measurement_end")
+            self.measuring = False
+            if self.mbw_started:
+                self.mbw_stats = self.mbw.stats()
+                self.mbw_started = False
+
+        super(FioServer, self).process_json(data)
 
     def start(self):
         super(FioServer, self).start()
@@ -94,12 +253,24 @@ class FioServer(FioRunner):
     def bandwidth(self):
         return None
 
+    def iops(self):
+        return None
+
+    def iops_per_job(self):
+        return None
+
     def latency(self):
         return None
 
+    def latency_histogram(self):
+        return None
+
     def volume(self):
         return None
 
+class PinnedFioServer(likwid.LikwidPinMixin, proc.TimeMixin, FioServer):
+    pass
+
 class LikwidFioServer(likwid.LikwidPerfMixin, proc.TimeMixin, FioServer):
     pass
 
@@ -109,13 +280,14 @@ class FioClient(proc.TimeProcessLineMixin, FioRunner):
              ioengine=rdma
              runtime={duration}
              hostname=${{SERVER}}
-             port=11692
+             port={port}
              verb={verb}
              bs={block_size}
              size={size}"""
 
     def __init__(self, host, command="fio:write", duration=10, block_size=512,
-                 size=100<<40, **kwargs):
+                 size=100<<40, port=None, **kwargs):
+        self.port = port or 11692
         self.block_size = block_size
         self.size = size
         if ":" in command:
@@ -123,36 +295,196 @@ class FioClient(proc.TimeProcessLineMixin, FioRunner):
         else:
             self.verb = "write"
         self.duration = duration
-        self._volume = self._bandwidth = self._latency = None
 
         super(FioClient, self).__init__(**kwargs)
 
         self.args = ["SERVER=${SSH_CLIENT%% *}", "time", "-p"] + self.exe
-        self.exe = ["ssh", host]
+        self.exe = ssh.command(host)
 
-    lat_re = re.compile(r"^[^:]*: *min= *(?P<min>[0-9.e]+), *"
-                        r"max= *(?P<max>[0-9.e]+), *"
-                        r"avg= *(?P<avg>[0-9.e]+), *"
-                        r"stdev= *(?P<stdev>[0-9.e]+)")
+class FioBlockRunner(proc.TimeMixin, FioRunner):
+    """Run a fio job against local block devices (or files), with one
+    job section per device all reported as a single group."""
+
+    job = """[global]
+             ioengine={ioengine}
+             rw={rw}
+             bs={block_size}
+             iodepth={iodepth}
+             numjobs={numjobs}
+             direct=1
+             time_based=1
+             runtime={duration}
+             group_reporting=1"""
+
+    def __init__(self, devices, rw="randread", block_size=4096, iodepth=1,
+                 numjobs=1, duration=10, ioengine="io_uring", size=None,
+                 **kwargs):
+        self.rw = rw
+        self.block_size = block_size
+        self.iodepth = iodepth
+        self.numjobs = numjobs
+        self.duration = duration
+        self.ioengine = ioengine
+        self.measuring = False
+
+        if size is not None:
+            self.size = size
+            self.job += "\nsize={size}"
+
+        self.sections = "".join("\n[dev{}]\nfilename={}".format(i, dev)
+                                for i, dev in enumerate(devices))
+
+        super(FioBlockRunner, self).__init__(wait_for=True, **kwargs)
 
     def process_line(self, line):
-        super(FioClient, self).process_line(line)
-
-        line = line.strip()
-        if line.startswith("write:"):
-            line = line.split()
-            self._volume = suffix.parse_suffix(line[1].split("=")[1])
-            self._bandwidth = suffix.parse_suffix(line[2].split("=")[1])
-        elif line.startswith("lat"):
-            m = self.lat_re.match(line)
-            if m:
-                self._latency = {k: float(v) for k,v in m.groupdict().items()}
+        super(FioBlockRunner, self).process_line(line)
 
-    def bandwidth(self):
-        return self._bandwidth
+        if not self.measuring and line.startswith("Jobs"):
+            self.mark_phase("measurement_start")
+            self.measuring = True
 
-    def latency(self):
-        return self._latency
+    def process_json(self, data):
+        if self.measuring:
+            self.mark_phase("measurement_end")
+            self.measuring = False
 
-    def volume(self):
-        return self._volume
+        super(FioBlockRunner, self).process_json(data)
+
+class FioJobRunner(FioRunner):
+    """Run an existing fio job file."""
+
+    def __init__(self, jobfile, **kwargs):
+        super(FioJobRunner, self).__init__(**kwargs)
+        self.exe[-1] = jobfile
+
+    def setup(self):
+        self.p.stdin.close()
+
+def _status_totals(data):
+    """Sum the cumulative counters of every job in a fio status dump for
+    each data direction."""
+
+    ret = OrderedDict()
+    for ddir in ("read", "write"):
+        tot = {"bytes": 0, "ios": 0, "lat_n": 0, "lat_sum": 0., "bins": {}}
+        for job in data.get("jobs", []):
+            d = job.get(ddir, {})
+            lat = d.get("lat_ns", {})
+
+            tot["bytes"] += d.get("io_bytes", 0)
+            tot["ios"] += d.get("total_ios", 0)
+            tot["lat_n"] += lat.get("N", 0)
+            tot["lat_sum"] += lat.get("N", 0) * lat.get("mean", 0)
+            for ns, c in d.get("clat_ns", {}).get("bins", {}).items():
+                tot["bins"][ns] = tot["bins"].get(ns, 0) + c
+
+        ret[ddir] = tot
+
+    return ret
+
+class FioTimeline(utils.Timeline):
+    """Run a fio job file and report the bandwidth, IOPS and latency of
+    each interval from the status fio dumps every period. Latency
+    percentiles come from the difference between the completion latency
+    histograms of consecutive dumps."""
+
+    percentiles = [50, 99, 99.9]
+
+    def __init__(self, jobfile, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.inst = FioJobRunner(jobfile, status_interval=self.period)
+        self.last_status = None
+        self.last_totals = None
+        self.latest = None
+
+    def __enter__(self):
+        self.inst.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.inst.__exit__(type, value, traceback)
+
+    def _interval(self, status, totals):
+        if self.last_totals is None:
+            elapsed = status.get("jobs", [{}])[0].get("elapsed", 0)
+            last = {d: {"bytes": 0, "ios": 0, "lat_n": 0, "lat_sum": 0.,
+                        "bins": {}} for d in totals}
+        else:
+            elapsed = ((status.get("timestamp_ms", 0) -
+                        self.last_status.get("timestamp_ms", 0)) / 1e3)
+            last = self.last_totals
+
+        elapsed = elapsed or self.duration or self.period
+
+        ret = OrderedDict()
+        for ddir, tot in totals.items():
+            prev = last[ddir]
+            lat_n = tot["lat_n"] - prev["lat_n"]
+
+            hist = sorted((int(ns) / 1e3, c - prev["bins"].get(ns, 0))
+                          for ns, c in tot["bins"].items())
+            pcts = hist_percentiles(hist, self.percentiles)
+
+            ret[ddir + "_rate"] = (tot["bytes"] - prev["bytes"]) / elapsed
+            ret[ddir + "_io_rate"] = (tot["ios"] - prev["ios"]) / elapsed
+            ret[ddir + "_lat_us"] = ((tot["lat_sum"] - prev["lat_sum"]) /
+                                     lat_n / 1e3 if lat_n else 0)
+            for p in self.percentiles:
+                ret["{}_{}_us".format(ddir, percentile_name(p))] = \
+                    pcts.get(percentile_name(p), 0)
+
+        return ret
+
+    def next(self):
+        super().next()
+
+        status = self.inst.status
+
+        # Keep reporting the last interval until fio dumps a new status
+        if status is None:
+            totals = _status_totals({})
+            self.latest = self._interval({}, totals)
+        elif status is not self.last_status:
+            totals = _status_totals(status)
+            self.latest = self._interval(status, totals)
+            self.last_status = status
+            self.last_totals = totals
+
+        return self.latest
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}Fio Stats:{c.rst}".format(indent, c=colours))
+        indent += "  "
+
+        for ddir in ("read", "write"):
+            pcts = "  ".join("{}: {:>8.2f}".format(percentile_name(p),
+                             stats["{}_{}_us".format(ddir,
+                                                     percentile_name(p))])
+                             for p in self.percentiles)
+
+            print("{}{:<10} {:>10.1f}  {:>10.1f}  avg: {:>8.2f}  {}  us".
+                  format(indent, ddir + ":",
+                         Suffix(stats[ddir + "_rate"], unit="B/s"),
+                         Suffix(stats[ddir + "_io_rate"], unit="IOPS",
+                                decimal=True),
+                         stats[ddir + "_lat_us"], pcts))
+
+    def csv(self):
+        return self.latest.values()
+
+    def csv_titles(self):
+        return tuple("fio:" + t for t in self.latest.keys())
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    with FioTimeline(sys.argv[1]) as tl:
+        while True:
+            print(time.asctime())
+            tl.print_next()
+            print()
+            print()
@@ -15,7 +15,7 @@
 ##
 ########################################################################
 
-from . import likwid, proc
+from . import likwid, proc, ssh
 
 import re
 import threading
@@ -50,6 +50,7 @@ class PerfTestOutputMixin(object):
             try:
                 line = [float(x) for x in line.split()]
                 self.values.update(zip(self.fields, line))
+                self.mark_phase("measurement_end")
                 if self.mbw is not None:
                     self.mbw_stats = self.mbw.stats()
             except ValueError:
@@ -57,6 +58,9 @@ class PerfTestOutputMixin(object):
         elif line.startswith(" #bytes"):
             self.fields = [self._process_field(f) for f in  re.split(" {2,}", line)]
             self.results_line = True
+            self.mark_phase("measurement_start")
+        elif line.strip().startswith("remote address:"):
+            self.mark_phase("client_connected")
 
     def finish(self):
         if self.mbw_stats is None and self.mbw is not None:
@@ -70,6 +74,15 @@ class PerfTestOutputMixin(object):
 
         return bw * 1000**2
 
+    def iops(self):
+        rate = self.values.get("MsgRate", None)
+        if rate is None: return None
+
+        return rate * 1e6
+
+    def iops_per_job(self):
+        return None
+
     def volume(self):
         bytes = self.values.get("bytes", None)
         its = self.values.get("iterations", None)
@@ -90,12 +103,17 @@ class PerfTestOutputMixin(object):
                 'min': mn,
                 'max': mx}
 
+    def latency_histogram(self):
+        return None
+
 class PerfTestServer(PerfTestOutputMixin, proc.ProcRunner):
     def __init__(self, command="ib_write_bw", block_size=8388608, duration=5,
-                 mmap=None, test_args=[], *args, **kwargs):
+                 mmap=None, port=None, test_args=[], *args, **kwargs):
         super(PerfTestServer, self).__init__(*args, **kwargs)
         self.exe = [command]
         self.args = ["-R", "-s", str(block_size), "-D", str(duration)]
+        if port is not None:
+            self.args += ["-p", str(port)]
         self.args += test_args
 
         if mmap:
@@ -107,6 +125,7 @@ class PerfTestServer(PerfTestOutputMixin, proc.ProcRunner):
         super(PerfTestServer, self).process_line(line)
 
         if "Waiting for client to connect" in line:
+            self.mark_phase("server_ready")
             self.ready.set()
 
         if self.mbw is not None and line.startswith(" #bytes"):
@@ -118,6 +137,10 @@ class PerfTestServer(PerfTestOutputMixin, proc.ProcRunner):
             raise proc.ProcRunnerException(self,
                 "Timed out waiting for perftest server to start")
 
+class PinnedPerfTestServer(likwid.LikwidPinMixin, proc.TimeMixin,
+                           PerfTestServer):
+    pass
+
 class LikwidPerfTestServer(likwid.LikwidPerfMixin, proc.TimeMixin,
                            PerfTestServer):
     pass
@@ -125,9 +148,11 @@ class LikwidPerfTestServer(likwid.LikwidPerfMixin, proc.TimeMixin,
 class PerfTestClient(PerfTestOutputMixin, proc.TimeProcessLineMixin,
                      proc.ProcRunner):
     def __init__(self, host, command="ib_write_bw", block_size=8388608,
-                 duration=5, test_args=[], *args, **kwargs):
+                 duration=5, port=None, test_args=[], *args, **kwargs):
         super(PerfTestClient, self).__init__(*args, **kwargs)
-        self.exe = ["ssh", host, "time", "-p", command]
+        self.exe = ssh.command(host) + ["time", "-p", command]
         self.args = ["-R", "${SSH_CLIENT%% *}", "-s", str(block_size),
                      "-D", str(duration)]
+        if port is not None:
+            self.args += ["-p", str(port)]
         self.args += test_args
@@ -0,0 +1,303 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, topology, utils
+from .suffix import Suffix
+
+import re
+import fnmatch
+
+from collections import namedtuple, OrderedDict
+
+class InterruptsException(Exception):
+    pass
+
+bdf_re = re.compile(r"([0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7])")
+
+# Patterns to split an interrupt's name into the device and the hardware
+# queue it serves, tried in order. Devices named by PCI address are
+# renamed to their RDMA or network device.
+queue_res = [
+    re.compile(r"^(?P<dev>nvme\d+)q(?P<queue>\d+)$"),
+    re.compile(r"^mlx5_comp(?P<queue>\d+)@pci:(?P<bdf>\S+)$"),
+    re.compile(r"^mlx5_\w+@pci:(?P<bdf>\S+)$"),
+    re.compile(r"^(?P<dev>\S+?)[-_]?(?:q|queue|comp|req\.|input\.|"
+               r"output\.|TxRx-|rx-|tx-)(?P<queue>\d+)$"),
+]
+
+Irq = namedtuple("Irq", ["irq", "device", "queue", "bdf"])
+
+def parse_irq(irq, desc):
+    """Work out the device, queue and PCI function of an interrupt
+    from the rest of its line in /proc/interrupts (after the counts),
+    eg. 'IR-PCI-MSIX-0000:3b:00.0 1-edge nvme0q1'."""
+
+    fields = desc.split()
+    if not fields:
+        return Irq(irq, None, None, None)
+
+    name = fields[-1]
+    m = bdf_re.search(desc)
+    bdf = m.group(1) if m else None
+
+    for r in queue_res:
+        m = r.match(name)
+        if not m:
+            continue
+
+        g = m.groupdict()
+        bdf = g.get("bdf") or bdf
+        dev = g.get("dev") or topology.pci_device_name(bdf)
+        queue = int(g["queue"]) if g.get("queue") else None
+        return Irq(irq, dev, queue, bdf)
+
+    return Irq(irq, name, None, bdf)
+
+class Interrupts(object):
+    """Reader of /proc/interrupts. The column layout and the device of
+    each line are worked out once and reused until the set of lines
+    changes, so each sample only converts the counts."""
+
+    def __init__(self, devices=[], path="/proc/interrupts"):
+        self.patterns = devices
+        self.path = path
+        self.layout = None
+
+    def _wanted(self, irq):
+        if irq.device is None:
+            return False
+        if not self.patterns:
+            return irq.bdf is not None
+        return any(fnmatch.fnmatchcase(irq.device, p) for p in self.patterns)
+
+    def _build_layout(self, lines):
+        self.cpus = [int(c[3:]) for c in lines[0].split()]
+        self.nlines = len(lines)
+        self.layout = []
+
+        ncpus = len(self.cpus)
+        irqs = []
+        for i, l in enumerate(lines[1:], 1):
+            key, _, rest = l.partition(":")
+            key = key.strip()
+            if not key.isdigit():
+                continue
+
+            fields = rest.split(None, ncpus)
+            irqs.append((i, key, parse_irq(int(key), fields[ncpus]
+                                           if len(fields) > ncpus else "")))
+
+        # Name every interrupt of a PCI function after the device its
+        # queues belong to so the config and async vectors join them
+        names = {}
+        for i, key, irq in irqs:
+            if irq.bdf and irq.queue is not None:
+                names.setdefault(irq.bdf, irq.device)
+
+        for i, key, irq in irqs:
+            if irq.bdf:
+                irq = irq._replace(device=names.get(irq.bdf) or
+                                   topology.pci_device_name(irq.bdf))
+            if self._wanted(irq):
+                self.layout.append((i, key, irq))
+
+    def read(self):
+        """Return a list of (Irq, per-CPU counts) for each interrupt of
+        the selected devices."""
+
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+
+        if self.layout is None or len(lines) != self.nlines:
+            self._build_layout(lines)
+
+        ncpus = len(self.cpus)
+        ret = []
+        for i, key, irq in self.layout:
+            k, _, rest = lines[i].partition(":")
+            if k.strip() != key:
+                self._build_layout(lines)
+                return self.read()
+
+            ret.append((irq, [int(x) for x in
+                              rest.split(None, ncpus)[:ncpus]]))
+
+        return ret
+
+class DeviceInterrupts(object):
+    def __init__(self, name, bdf):
+        self.name = name
+        self.bdf = bdf
+        self.queues = OrderedDict()
+
+        self.numa_node = None
+        if bdf:
+            try:
+                self.numa_node = topology.locate(bdf).numa_node
+            except topology.TopologyException:
+                pass
+
+class InterruptsTimeline(utils.Timeline):
+    """Interrupt rates of each device (all PCI devices by default, or
+    those matching the given patterns, eg. 'nvme*' and 'mlx5_*') split
+    by CPU and hardware queue, with how unevenly they are spread over
+    the CPUs and how many land on CPUs off the device's NUMA node."""
+
+    # A CPU counts as serving a device if it takes at least this
+    # fraction of the device's interrupts
+    active_threshold = 0.01
+
+    def __init__(self, devices=[], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.reader = Interrupts(devices)
+        self.cpu_nodes = topology.cpu_nodes()
+        self.devices = OrderedDict()
+        self.last = None
+
+    def _device(self, irq):
+        dev = self.devices.get(irq.device)
+        if dev is None:
+            dev = self.devices[irq.device] = DeviceInterrupts(irq.device,
+                                                              irq.bdf)
+        return dev
+
+    def _stats(self, dev, per_cpu, cpus):
+        total = sum(per_cpu)
+        rate = total / self.duration if self.duration else 0
+
+        active = [c for c in per_cpu
+                  if total and c >= total * self.active_threshold]
+        busiest = max(range(len(per_cpu)), key=per_cpu.__getitem__)
+
+        if dev.numa_node is None or not self.cpu_nodes:
+            remote = float("nan")
+        elif total:
+            remote = sum(c for cpu, c in zip(cpus, per_cpu)
+                         if self.cpu_nodes.get(cpu) != dev.numa_node) / total
+        else:
+            remote = 0
+
+        ret = OrderedDict()
+        ret["intr"] = total
+        ret["intr_rate"] = rate
+        ret["cpus"] = len(active)
+        ret["busiest_cpu"] = cpus[busiest] if total else -1
+        ret["busiest_pct"] = per_cpu[busiest] / total if total else 0
+        ret["imbalance"] = (max(active) / (sum(active) / len(active))
+                            if active else 0)
+        ret["remote_pct"] = remote
+        return ret
+
+    def next(self):
+        super().next()
+
+        counts = self.reader.read()
+        cpus = self.reader.cpus
+
+        if self.last:
+            deltas = [(irq, [a - b for a, b in zip(c, self.last[irq.irq])]
+                       if irq.irq in self.last else [0] * len(c))
+                      for irq, c in counts]
+        else:
+            deltas = counts
+
+        self.last = {irq.irq: c for irq, c in counts}
+
+        per_dev = OrderedDict()
+        for irq, d in deltas:
+            dev = self._device(irq)
+            per_dev.setdefault(dev.name, []).append((irq, d))
+            if irq.queue is not None:
+                dev.queues[irq.queue] = irq.irq
+
+        ret = OrderedDict()
+        self.per_cpu = OrderedDict()
+        for name, irqs in per_dev.items():
+            dev = self.devices[name]
+            per_cpu = [sum(col) for col in zip(*(d for irq, d in irqs))]
+            self.per_cpu[name] = per_cpu
+
+            stats = self._stats(dev, per_cpu, cpus)
+            for irq, d in sorted(irqs, key=lambda x: (x[0].queue is None,
+                                                       x[0].queue)):
+                if irq.queue is None:
+                    continue
+
+                total = sum(d)
+                q = "q{}".format(irq.queue)
+                stats[q + "_rate"] = (total / self.duration
+                                      if self.duration else 0)
+                stats[q + "_cpu"] = (cpus[max(range(len(d)),
+                                              key=d.__getitem__)]
+                                     if total else -1)
+
+            ret[name] = stats
+
+        self.latest = ret
+        return ret
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}Interrupts:{c.rst}".format(indent, c=colours))
+        indent += "  "
+
+        for name, s in stats.items():
+            dev = self.devices[name]
+            node = "?" if dev.numa_node is None else dev.numa_node
+
+            print("{}{:<30} rate:  {:>7.1f}  \ton {} CPUs, busiest CPU {} "
+                  "({:.1%})".format(indent, name,
+                                    Suffix(s["intr_rate"], unit="IRQ/s",
+                                           decimal=True),
+                                    s["cpus"], s["busiest_cpu"],
+                                    s["busiest_pct"]))
+            print("{}{:<30} imbalance: {:.2f}  \toff node {}: {:.1%}".
+                  format(indent, "", s["imbalance"], node, s["remote_pct"]))
+
+            per_cpu = ["{}:{:.0f}".format(c, n / self.duration)
+                       for c, n in zip(self.reader.cpus, self.per_cpu[name])
+                       if n and self.duration]
+            if per_cpu:
+                print("{}{:<30} cpus:  {}".format(indent, "",
+                                                  " ".join(per_cpu)))
+
+            queues = ["{}->{}".format(k[1:-5], s[k[:-4] + "cpu"])
+                      for k in s if k.startswith("q") and
+                      k.endswith("_rate") and s[k]]
+            if queues:
+                print("{}{:<30} queues: {}".format(indent, "",
+                                                   " ".join(queues)))
+
+    def csv(self):
+        return tuple(x for y in self.latest.values() for x in y.values())
+
+    def csv_titles(self):
+        return tuple("{}:{}".format(n, x) for n, y in self.latest.items()
+                     for x in y.keys())
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    tl = InterruptsTimeline(period=2.0, devices=sys.argv[1:])
+
+    while True:
+        print(time.asctime())
+        tl.print_next();
+        print()
+        print()
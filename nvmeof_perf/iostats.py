@@ -14,7 +14,7 @@
 ##
 ########################################################################
 
-from . import colours, utils
+from . import colours, topology, utils
 from .suffix import Suffix
 
 import os
@@ -75,6 +75,7 @@ class IoStatsTimeline(utils.Timeline):
         super().__init__(*args, **kwargs)
 
         self.devices = devices
+        self.links = topology.pcie_links(devices)
         self.last = None
 
     def next(self):
@@ -100,11 +101,17 @@ class IoStatsTimeline(utils.Timeline):
             write_rate = write / self.duration if self.duration else 0
             io_rate = (ios / self.duration) if self.duration else 0
 
-            ret[d] = (read, read_rate, write, write_rate, ios, io_rate)
+            # Reads travel up the link from the device, writes down it
+            read_link = topology.link_utilization(self.links[d], read_rate)
+            write_link = topology.link_utilization(self.links[d], write_rate)
+
+            ret[d] = (read, read_rate, write, write_rate, ios, io_rate,
+                      read_link, write_link)
 
         self.latest = ret
         self.latest_titles = ("read", "read_rate", "write", "write_rate",
-                              "ios", "io_rate")
+                              "ios", "io_rate", "read_link_pct",
+                              "write_link_pct")
 
         return ret
 
@@ -114,7 +121,9 @@ class IoStatsTimeline(utils.Timeline):
         print("{}{c.bold}IO Stats:{c.rst}".format(indent, c=colours))
         indent += "  "
 
-        for d, (rd, rd_rate, wr, wr_rate, io, io_rate) in stats.items():
+        for d, (rd, rd_rate, wr, wr_rate, io, io_rate,
+                rd_link, wr_link) in stats.items():
+            link = self.links[d]
             d = os.path.basename(d)
 
             rd = Suffix(rd)
@@ -132,6 +141,11 @@ class IoStatsTimeline(utils.Timeline):
             print("{}{:<30} ios:   {:>7.1f}  \t{:>7.1f}".
                   format(indent, "", io, io_rate))
 
+            if link:
+                topology.print_link(link, indent)
+                print("{}{:<30} util:  {:>7.1%} rd\t{:>7.1%} wr".
+                      format(indent, "", rd_link, wr_link))
+
     def csv(self):
         return tuple(x for y in self.latest.values() for x in y)
 
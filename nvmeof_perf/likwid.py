@@ -28,9 +28,9 @@ from io import StringIO
 from collections import OrderedDict
 
 class LikwidPerfMixin(object):
-    likwid_re = re.compile(r"^\|\s+(?P<name>[^\[\|]+)" +
-                           r"( \[(?P<units>.*?)\])?\s+" +
-                           r"\|\s+(?P<value>[0-9\.e\+]+)\s+\|")
+    likwid_name_re = re.compile(r"^(?P<name>[^\[]+?)" +
+                                r"( \[(?P<units>.*?)\])?" +
+                                r"(?P<stat> STAT)?$")
 
     def __init__(self, groups=["MEM"], cpu="S0:0", *args, **kwargs):
         super(LikwidPerfMixin, self).__init__(*args, **kwargs)
@@ -38,14 +38,63 @@ class LikwidPerfMixin(object):
         self.exe = ["likwid-perfctr", "-f", "-C", cpu] + groups + self.exe
         self.likwid_stats = {}
         self.likwid_units = {}
+        self.likwid_cpu_stats = OrderedDict()
+        self._likwid_cols = None
 
     def process_line(self, line):
         super(LikwidPerfMixin, self).process_line(line)
 
-        m = self.likwid_re.match(line)
+        if not line.startswith("|"):
+            return
+
+        cells = [c.strip() for c in line.strip().strip("|").split("|")]
+        if cells[0] in ("Metric", "Event"):
+            self._likwid_cols = cells[1:] if cells[0] == "Metric" else None
+            return
+
+        if not self._likwid_cols:
+            return
+
+        m = self.likwid_name_re.match(cells[0])
         if not m: return
-        self.likwid_stats[m.group("name")] = float(m.group("value"))
-        self.likwid_units[m.group("name")] = m.group("units")
+
+        try:
+            values = [float(x) for x in cells[1:]]
+        except ValueError:
+            return
+
+        name = m.group("name")
+        units = m.group("units")
+        first = values[0]
+        values = OrderedDict(zip(self._likwid_cols, values))
+
+        # With more than one CPU the totals come from the statistics
+        # table, but only data volumes and bandwidths make sense summed.
+        if m.group("stat"):
+            if units and "Byte" in units and "Sum" in values:
+                self.likwid_stats[name] = values["Sum"]
+            return
+
+        self.likwid_stats[name] = first
+        self.likwid_units[name] = units
+
+        for cpu, v in values.items():
+            self.likwid_cpu_stats.setdefault(cpu, OrderedDict())[name] = v
+
+    def likwid_socket_stats(self):
+        ret = OrderedDict()
+        for col, st in self.likwid_cpu_stats.items():
+            try:
+                sock = "S{}".format(cpu_socket(int(col.split()[-1])))
+            except (ValueError, IOError):
+                sock = col
+            ret.setdefault(sock, st)
+        return ret
+
+class LikwidPinMixin(object):
+    def __init__(self, cpu="S0:0", *args, **kwargs):
+        super(LikwidPinMixin, self).__init__(*args, **kwargs)
+        self.exe = ["likwid-pin", "-q", "-c", cpu] + self.exe
 
 class LikwidException(Exception):
     pass
@@ -100,7 +149,7 @@ class LikwidTimeline(proc.ProcRunner):
     kill_me = True
 
     def __init__(self, groups=["L3", "MEM"], cpu=None, period=1.0, **kwargs):
-        super().__init__(self, **kwargs)
+        super().__init__(**kwargs)
 
         groups_args = [y for x in zip(["-g"] * len(groups), groups) for y in x]
 
@@ -215,6 +264,33 @@ class LikwidTimeline(proc.ProcRunner):
         return tuple("{}:{}".format(c, t) for g in self.groups.values()
                      for c in g.cpus for t in self.latest[g.name][0][0].keys())
 
+def cpu_socket(cpu):
+    path = "/sys/devices/system/cpu/cpu{}/topology/physical_package_id"
+    with open(path.format(cpu)) as f:
+        return int(f.read())
+
+def likwid_socket(cpu):
+    m = re.match(r"^S([0-9]+):", cpu)
+    if m:
+        return int(m.group(1))
+    if cpu.isdigit():
+        return cpu_socket(int(cpu))
+    return None
+
+def likwid_measure_cpus(cpus):
+    """Return a likwid-perfctr CPU expression that pins to the first of
+    the given CPUs and also measures every other socket they are on,
+    as the memory counters are only read on one CPU per socket."""
+
+    first = likwid_socket(cpus[0])
+    sockets = []
+    for c in cpus[1:]:
+        s = likwid_socket(c)
+        if s is not None and s != first and s not in sockets:
+            sockets.append(s)
+
+    return "@".join([cpus[0]] + ["S{}:0".format(s) for s in sorted(sockets)])
+
 def likwid_all_sockets():
     data = sp.check_output(["likwid-pin", "-p"]).decode()
     domain_re = re.compile(r"^Domain (S[0-9]+):$")
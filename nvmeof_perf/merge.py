@@ -0,0 +1,202 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import ssh, utils
+
+import os
+import csv
+import time
+import bisect
+import subprocess as sp
+
+class MergeException(Exception):
+    pass
+
+def ssh_clock_offset(host, count=5):
+    """Estimate how far host's clock is ahead of the local one by timing
+    a few ssh round trips that read the remote clock."""
+
+    exchanges = []
+    for i in range(count):
+        t0 = time.time()
+        out = sp.check_output(ssh.command(host) + ["date", "+%s.%N"])
+        t1 = time.time()
+        exchanges.append((t0, float(out.decode().strip()), t1))
+
+    return utils.estimate_clock_offset(exchanges)
+
+class Recording(object):
+    """A CSV file written by nvmeof-perf. Rows starting with '#' are
+    markers: '#host,NAME' names the host the file was recorded on and
+    '#sync,HOST,TIME,OFFSET,RTT' records the clock offset of another
+    host measured at TIME."""
+
+    def __init__(self, fname, host=None):
+        self.fname = fname
+        self.host = host
+        self.syncs = {}
+        self.times = []
+        self.rows = []
+        self.titles = None
+
+        with open(fname) as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                if row[0].startswith("#"):
+                    self._marker(row[0][1:], row[1:])
+                elif self.titles is None:
+                    self.titles = row[1:]
+                else:
+                    self.times.append(float(row[0]))
+                    self.rows.append([self._float(x) for x in row[1:]])
+
+        if self.host is None:
+            self.host = os.path.splitext(os.path.basename(fname))[0]
+
+        if not self.rows:
+            raise MergeException("No samples in {}".format(fname))
+
+    @staticmethod
+    def _float(x):
+        try:
+            return float(x)
+        except ValueError:
+            return float("nan")
+
+    def _marker(self, name, fields):
+        if name == "host" and self.host is None:
+            self.host = fields[0]
+        elif name == "sync":
+            host, tm, offset, rtt = fields
+            self.syncs.setdefault(host, []).append((float(tm), float(offset)))
+
+    def period(self):
+        deltas = sorted(b - a for a, b in zip(self.times, self.times[1:]))
+        return deltas[len(deltas) // 2] if deltas else 1.0
+
+class ClockOffset(object):
+    """Offset of a clock from the reference clock, interpolated linearly
+    between sync points to follow drift."""
+
+    def __init__(self, points):
+        self.points = sorted(points)
+        self.times = [t for t, o in self.points]
+
+    def __call__(self, tm):
+        i = bisect.bisect_left(self.times, tm)
+        if i == 0:
+            return self.points[0][1]
+        if i == len(self.points):
+            return self.points[-1][1]
+
+        (ta, oa), (tb, ob) = self.points[i - 1], self.points[i]
+        return oa + (ob - oa) * (tm - ta) / (tb - ta)
+
+def resolve_offsets(recordings, offsets={}):
+    """Work out the clock offset of every recording relative to the
+    first one from the explicit offsets (in seconds) and the sync
+    markers in the recordings themselves."""
+
+    ref = recordings[0]
+    ret = {ref.host: ClockOffset([(0, 0)])}
+
+    for host, offset in offsets.items():
+        ret[host] = ClockOffset([(0, offset)])
+
+    changed = True
+    while changed:
+        changed = False
+        for r in recordings:
+            if r.host not in ret:
+                continue
+            base = ret[r.host]
+            for host, points in r.syncs.items():
+                if host in ret:
+                    continue
+                ret[host] = ClockOffset([(t + o, base(t) + o)
+                                         for t, o in points])
+                changed = True
+
+    for r in recordings:
+        if r.host not in ret:
+            raise MergeException("No clock offset known for {} ({}), "
+                                 "record it with --sync or give it "
+                                 "explicitly".format(r.host, r.fname))
+
+    return ret
+
+def _resample(times, rows, timebase):
+    """Linearly interpolate every column of rows at each time in
+    timebase. The bracketing samples and weights are found once per
+    output row and shared by all columns."""
+
+    ret = []
+    i = 0
+    for t in timebase:
+        while i < len(times) - 2 and times[i + 1] < t:
+            i += 1
+
+        ta, tb = times[i], times[i + 1]
+        w = (t - ta) / (tb - ta) if tb != ta else 0
+        w = min(max(w, 0), 1)
+
+        ret.append([a + (b - a) * w for a, b in zip(rows[i], rows[i + 1])])
+
+    return ret
+
+def merge(recordings, offsets={}, period=None):
+    """Return the titles and rows of all recordings resampled onto a
+    common timebase in the clock of the first recording."""
+
+    clocks = resolve_offsets(recordings, offsets)
+
+    for r in recordings:
+        if len(r.rows) < 2:
+            raise MergeException("Not enough samples in {}".format(r.fname))
+
+    aligned = []
+    for r in recordings:
+        off = clocks[r.host]
+        aligned.append([t - off(t) for t in r.times])
+
+    start = max(t[0] for t in aligned)
+    end = min(t[-1] for t in aligned)
+    if start >= end:
+        raise MergeException("Recordings don't overlap in time")
+
+    period = period or recordings[0].period()
+    timebase = []
+    t = start
+    while t <= end:
+        timebase.append(t)
+        t += period
+
+    titles = ["timestamp"]
+    columns = []
+    for r, times in zip(recordings, aligned):
+        titles += ["{}:{}".format(r.host, t) for t in r.titles]
+        columns.append(_resample(times, r.rows, timebase))
+
+    rows = [[t] + [x for c in cols for x in c]
+            for t, cols in zip(timebase, zip(*columns))]
+
+    return titles, rows
+
+def write_merged(f, titles, rows):
+    w = csv.writer(f)
+    w.writerow(titles)
+    w.writerows(rows)
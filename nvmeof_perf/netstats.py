@@ -0,0 +1,285 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, utils
+from .suffix import Suffix
+
+import socket
+import struct
+
+from collections import OrderedDict
+
+class NetStatsException(Exception):
+    pass
+
+# Default port of NVMe/TCP
+nvme_tcp_port = 4420
+
+dev_names = ["rx", "rx_packets", "rx_errs", "rx_drop", None, None, None,
+             None, "tx", "tx_packets", "tx_errs", "tx_drop"]
+
+# Counters from /proc/net/snmp and /proc/net/netstat, and the names
+# they're reported under
+tcp_counters = [("Tcp", "InSegs", "in_segs"),
+                ("Tcp", "OutSegs", "out_segs"),
+                ("Tcp", "RetransSegs", "retrans_segs"),
+                ("Tcp", "InErrs", "in_errs"),
+                ("Tcp", "OutRsts", "out_rsts"),
+                ("TcpExt", "TCPTimeouts", "timeouts"),
+                ("TcpExt", "TCPOFOQueue", "ofo_queue"),
+                ("TcpExt", "TCPRcvQDrop", "rcvq_drop"),
+                ("TcpExt", "TCPBacklogDrop", "backlog_drop"),
+                ("TcpExt", "ListenOverflows", "listen_overflows"),
+                ("TcpExt", "ListenDrops", "listen_drops")]
+
+def dev_stats(interfaces=[]):
+    """Return the counters of each interface in /proc/net/dev (every one
+    but loopback if none are given)."""
+
+    ret = OrderedDict()
+    with open("/proc/net/dev") as f:
+        for l in f.readlines()[2:]:
+            name, _, data = l.partition(":")
+            name = name.strip()
+            if interfaces and name not in interfaces:
+                continue
+            if not interfaces and name == "lo":
+                continue
+
+            ret[name] = OrderedDict((n, int(x)) for n, x in
+                                    zip(dev_names, data.split()) if n)
+
+    for i in interfaces:
+        if i not in ret:
+            raise NetStatsException("Interface not found: {}".format(i))
+
+    return ret
+
+def _read_snmp(path):
+    """Parse a file of header and value line pairs like /proc/net/snmp
+    into {prefix: {name: value}}."""
+
+    ret = {}
+    with open(path) as f:
+        lines = f.readlines()
+
+    for titles, values in zip(lines[::2], lines[1::2]):
+        prefix, _, titles = titles.partition(":")
+        values = values.partition(":")[2]
+        ret[prefix] = dict(zip(titles.split(), (int(v) for v in
+                                                values.split())))
+    return ret
+
+def tcp_stats():
+    snmp = _read_snmp("/proc/net/snmp")
+    snmp.update(_read_snmp("/proc/net/netstat"))
+
+    return OrderedDict((name, snmp.get(prefix, {}).get(field, 0))
+                       for prefix, field, name in tcp_counters)
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+INET_DIAG_INFO = 2
+TCP_ESTABLISHED = 1
+
+nlmsghdr = struct.Struct("=IHHII")
+inet_diag_req_v2 = struct.Struct("=BBBxI48x")
+inet_diag_msg = struct.Struct("=BBBB2H16s16sI8sIIIII")
+rtattr = struct.Struct("=HH")
+
+# Offsets of the fields used from struct tcp_info
+tcpi_rtt = struct.Struct("=I"), 68
+tcpi_total_retrans = struct.Struct("=I"), 100
+tcpi_bytes_acked = struct.Struct("=Q"), 120
+tcpi_bytes_received = struct.Struct("=Q"), 128
+
+def _tcp_info(data, field):
+    fmt, offset = field
+    if len(data) < offset + fmt.size:
+        return 0
+    return fmt.unpack_from(data, offset)[0]
+
+def _diag_dump(family):
+    """Yield the inet_diag_msg and tcp_info of every established TCP
+    socket of an address family, as 'ss -ti' gets them."""
+
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                       NETLINK_SOCK_DIAG) as s:
+        req = inet_diag_req_v2.pack(family, socket.IPPROTO_TCP,
+                                    1 << (INET_DIAG_INFO - 1),
+                                    1 << TCP_ESTABLISHED)
+        s.send(nlmsghdr.pack(nlmsghdr.size + len(req), SOCK_DIAG_BY_FAMILY,
+                             NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + req)
+
+        while True:
+            data = s.recv(65536)
+            pos = 0
+            while pos + nlmsghdr.size <= len(data):
+                length, typ, flags, seq, pid = nlmsghdr.unpack_from(data,
+                                                                    pos)
+                if typ == NLMSG_DONE:
+                    return
+                if typ == NLMSG_ERROR:
+                    raise NetStatsException("inet_diag dump failed")
+
+                msg = data[pos + nlmsghdr.size:pos + length]
+                info = b""
+                apos = inet_diag_msg.size
+                while apos + rtattr.size <= len(msg):
+                    alen, atype = rtattr.unpack_from(msg, apos)
+                    if alen < rtattr.size:
+                        break
+                    if atype == INET_DIAG_INFO:
+                        info = msg[apos + rtattr.size:apos + alen]
+                    apos += (alen + 3) & ~3
+
+                yield inet_diag_msg.unpack_from(msg), info
+                pos += (length + 3) & ~3
+
+def port_sockets(port):
+    """Return the counters of every TCP connection to or from a port
+    keyed by the socket's cookie."""
+
+    ret = {}
+    for family in [socket.AF_INET, socket.AF_INET6]:
+        for msg, info in _diag_dump(family):
+            sport, dport = socket.ntohs(msg[4]), socket.ntohs(msg[5])
+            if port not in (sport, dport):
+                continue
+
+            ret[msg[9]] = {"recv_q": msg[11],
+                           "rtt": _tcp_info(info, tcpi_rtt),
+                           "retrans": _tcp_info(info, tcpi_total_retrans),
+                           "tx": _tcp_info(info, tcpi_bytes_acked),
+                           "rx": _tcp_info(info, tcpi_bytes_received)}
+    return ret
+
+class NetTimeline(utils.Timeline):
+    """Traffic of each network interface from /proc/net/dev and the
+    TCP retransmit, out of order and drop counters from /proc/net/snmp
+    and /proc/net/netstat. Given a port (eg. 4420 for NVMe/TCP) the
+    connections to it are also read over inet_diag netlink, as ss does,
+    to report just their traffic, retransmits, receive queues and
+    round trip times."""
+
+    def __init__(self, interfaces=[], port=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.interfaces = interfaces
+        self.port = port
+        self.last = None
+
+    def next(self):
+        super().next()
+
+        devs_new = dev_stats(self.interfaces)
+        tcp_new = tcp_stats()
+        socks_new = port_sockets(self.port) if self.port else {}
+
+        if self.last:
+            last_devs, last_tcp, last_socks = self.last
+        else:
+            last_devs, last_tcp, last_socks = devs_new, tcp_new, socks_new
+        self.last = devs_new, tcp_new, socks_new
+
+        def rate(x):
+            return x / self.duration if self.duration else 0
+
+        ret = OrderedDict()
+        for name, s in devs_new.items():
+            old = last_devs.get(name, s)
+            ret[name] = OrderedDict((n + "_rate", rate(v - old[n]))
+                                    for n, v in s.items())
+
+        ret["tcp"] = OrderedDict((n + "_rate", rate(v - last_tcp[n]))
+                                 for n, v in tcp_new.items())
+
+        if self.port:
+            def delta(name):
+                # New connections count from zero
+                return sum(s[name] - last_socks.get(c, {}).get(name, 0)
+                           for c, s in socks_new.items())
+
+            p = OrderedDict()
+            p["conns"] = len(socks_new)
+            p["tx_rate"] = rate(delta("tx"))
+            p["rx_rate"] = rate(delta("rx"))
+            p["retrans_rate"] = rate(delta("retrans"))
+            p["recv_q"] = sum(s["recv_q"] for s in socks_new.values())
+            p["rtt_us"] = (sum(s["rtt"] for s in socks_new.values()) /
+                           len(socks_new) if socks_new else 0)
+            ret["port{}".format(self.port)] = p
+
+        self.latest = ret
+        return ret
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}Network Stats:{c.rst}".format(indent, c=colours))
+        indent += "  "
+
+        for name, s in stats.items():
+            if name == "tcp" or name.startswith("port"):
+                continue
+
+            for d in ("rx", "tx"):
+                print("{}{:<30} {}:    {:>7.1f}  \t{:>7.1f}  \t"
+                      "drop {:.1f}/s errs {:.1f}/s".
+                      format(indent, name if d == "rx" else "", d,
+                             Suffix(s[d + "_rate"], unit="B/s"),
+                             Suffix(s[d + "_packets_rate"], unit="pkt/s",
+                                    decimal=True),
+                             s[d + "_drop_rate"], s[d + "_errs_rate"]))
+
+        print("{}TCP:".format(indent))
+        for n, v in stats["tcp"].items():
+            print("{}  {:<28} {:>9.1f}/s".format(indent, n[:-5] + ":", v))
+
+        if self.port:
+            p = stats["port{}".format(self.port)]
+            print("{}{:<30} {} connections, rtt {:.0f} us, recv-q {}".
+                  format(indent, "Port {}:".format(self.port), p["conns"],
+                         p["rtt_us"], p["recv_q"]))
+            print("{}  {:<28} {:>9.1f} rx\t{:>9.1f} tx\t{:.1f} retrans/s".
+                  format(indent, "",
+                         Suffix(p["rx_rate"], unit="B/s"),
+                         Suffix(p["tx_rate"], unit="B/s"),
+                         p["retrans_rate"]))
+
+    def csv(self):
+        return tuple(x for y in self.latest.values() for x in y.values())
+
+    def csv_titles(self):
+        return tuple("{}:{}".format(n, x) for n, y in self.latest.items()
+                     for x in y.keys())
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    tl = NetTimeline(period=2.0, port=int(sys.argv[1]) if sys.argv[1:]
+                     else nvme_tcp_port)
+
+    while True:
+        print(time.asctime())
+        tl.print_next();
+        print()
+        print()
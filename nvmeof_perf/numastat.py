@@ -0,0 +1,158 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, utils
+from .suffix import Suffix
+
+import os
+import re
+
+from collections import OrderedDict
+
+node_dir = "/sys/devices/system/node"
+
+page_size = os.sysconf("SC_PAGE_SIZE")
+
+# Per node allocation counters, in pages, from numastat
+numastat_names = ["numa_hit", "numa_miss", "numa_foreign", "local_node",
+                  "other_node"]
+
+# Events from /proc/vmstat that show pages moving between nodes or the
+# allocator struggling
+vmstat_names = ["pgfault", "pgmajfault", "pgmigrate_success",
+                "pgmigrate_fail", "numa_pages_migrated", "compact_stall",
+                "compact_fail"]
+
+def nodes():
+    try:
+        return sorted(int(m.group(1)) for m in
+                      (re.match(r"^node(\d+)$", n)
+                       for n in os.listdir(node_dir)) if m)
+    except OSError:
+        return []
+
+def _read_pairs(path):
+    ret = {}
+    with open(path) as f:
+        for l in f:
+            fields = l.split()
+            if len(fields) >= 2:
+                ret[fields[0]] = int(fields[1])
+    return ret
+
+def node_stats(node):
+    path = os.path.join(node_dir, "node{}".format(node))
+    ret = _read_pairs(os.path.join(path, "numastat"))
+
+    # Lines look like "Node 0 MemTotal:  4161272 kB"
+    with open(os.path.join(path, "meminfo")) as f:
+        for l in f:
+            fields = l.split()
+            if fields[2] in ("MemTotal:", "MemUsed:"):
+                ret[fields[2][:-1]] = int(fields[3]) * 1024
+
+    return ret
+
+def vmstat():
+    return _read_pairs("/proc/vmstat")
+
+class NumaTimeline(utils.Timeline):
+    """Memory use of each NUMA node with the rate of local and remote
+    page allocations on it (as bytes per second), plus the rates of the
+    page fault, migration and compaction events from /proc/vmstat.
+    numa_miss is memory allocated on a node other than the one asked
+    for, and other_node is memory allocated on a node by a process
+    running on another, both of which cost cross-socket DDR traffic."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.nodes = nodes()
+        self.last = None
+
+    def next(self):
+        super().next()
+
+        stats_new = OrderedDict(("node{}".format(n), node_stats(n))
+                                for n in self.nodes)
+        vm_new = vmstat()
+
+        last_nodes, last_vm = self.last or (stats_new, vm_new)
+        self.last = stats_new, vm_new
+
+        def delta(new, old, name):
+            return new.get(name, 0) - old.get(name, 0)
+
+        def rate(x):
+            return x / self.duration if self.duration else 0
+
+        ret = OrderedDict()
+        for name, s in stats_new.items():
+            old = last_nodes.get(name, s)
+
+            n = OrderedDict()
+            n["mem_used"] = s["MemUsed"]
+            n["mem_used_pct"] = s["MemUsed"] / s["MemTotal"]
+            for x in numastat_names:
+                n[x + "_rate"] = rate(delta(s, old, x) * page_size)
+            ret[name] = n
+
+        ret["vmstat"] = OrderedDict((x + "_rate",
+                                     rate(delta(vm_new, last_vm, x)))
+                                    for x in vmstat_names)
+
+        self.latest = ret
+        return ret
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}NUMA Stats:{c.rst}".format(indent, c=colours))
+        indent += "  "
+
+        for name, s in stats.items():
+            if name == "vmstat":
+                continue
+
+            print("{}{:<30} used:  {:>7.1f}  \t{:>7.1%}".
+                  format(indent, name, Suffix(s["mem_used"]),
+                         s["mem_used_pct"]))
+            for x in numastat_names:
+                print("{}  {:<28} {:>12.1f}".
+                      format(indent, x + ":",
+                             Suffix(s[x + "_rate"], unit="B/s")))
+
+        for x in vmstat_names:
+            print("{}{:<30} {:>9.1f}/s".format(indent, x + ":",
+                                                stats["vmstat"][x + "_rate"]))
+
+    def csv(self):
+        return tuple(x for y in self.latest.values() for x in y.values())
+
+    def csv_titles(self):
+        return tuple("{}:{}".format(n, x) for n, y in self.latest.items()
+                     for x in y.keys())
+
+if __name__ == "__main__":
+    import time
+
+    tl = NumaTimeline(period=2.0)
+
+    while True:
+        print(time.asctime())
+        tl.print_next();
+        print()
+        print()
@@ -0,0 +1,183 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, switchtec, topology, utils
+from .suffix import Suffix
+
+import os
+
+from collections import OrderedDict
+
+class P2pmemException(Exception):
+    pass
+
+pci_devices = "/sys/bus/pci/devices"
+
+def p2pmem_devices():
+    """Return the addresses of the PCI functions with a P2P memory pool
+    (eg. an NVMe CMB or a p2pmem card's BAR)."""
+
+    try:
+        return sorted(d for d in os.listdir(pci_devices)
+                      if os.path.isdir(os.path.join(pci_devices, d,
+                                                    "p2pmem")))
+    except OSError:
+        return []
+
+def p2pmem_stats(bdf):
+    """Return the size and available bytes of a device's pool and
+    whether it's published for other drivers (eg. nvmet) to use."""
+
+    path = os.path.join(pci_devices, bdf, "p2pmem")
+
+    def read(name):
+        with open(os.path.join(path, name)) as f:
+            return int(f.read().strip())
+
+    try:
+        return read("size"), read("available"), read("published")
+    except (IOError, ValueError):
+        raise P2pmemException("p2pmem stats not found for {}".format(bdf))
+
+def resolve_device(device):
+    bdfs = topology.pci_path(topology.sysfs_path(device))
+    if not bdfs:
+        raise P2pmemException("{} is not a PCI device".format(device))
+    return bdfs[-1]
+
+class SwitchtecPorts(object):
+    """Bandwidth counters of the Switchtec ports the P2P devices sit
+    below, found by matching each port's PCI device against the
+    device's path from the root port."""
+
+    def __init__(self, devpaths, bdfs):
+        self.ports = OrderedDict()
+
+        for devpath in devpaths:
+            sw = switchtec.Switchtec(devpath)
+            for st in sw.status():
+                if not st.link_up or not st.pci_dev:
+                    continue
+
+                pci_dev = st.pci_dev.strip().decode()
+                for bdf in bdfs:
+                    path = topology.pci_path(topology.sysfs_path(bdf))
+                    if pci_dev in path and bdf not in self.ports:
+                        self.ports[bdf] = sw, st.port.phys_id
+
+        self.last = {}
+
+    def rates(self):
+        ret = {}
+        for bdf, (sw, port) in self.ports.items():
+            bw = sw.bwcntr_many([port])[0]
+            last = self.last.get(bdf)
+            self.last[bdf] = bw
+            if last is None:
+                ret[bdf] = (0, 0)
+                continue
+
+            bw = bw - last
+            ret[bdf] = (bw.ingress.total() / bw.time(),
+                        bw.egress.total() / bw.time())
+        return ret
+
+class P2pmemTimeline(utils.Timeline):
+    """Size, use and published state of the P2P memory pool of each
+    device (every one in the system by default) and, given the
+    Switchtec devices they are behind, the traffic through their
+    switch ports. Whether the pool's use moves during a run shows if
+    the NVMe-oF target really used P2P buffers."""
+
+    def __init__(self, devices=[], switchtec_devices=[], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        bdfs = ([resolve_device(d) for d in devices] if devices else
+                p2pmem_devices())
+        if not bdfs:
+            raise P2pmemException("No p2pmem devices found")
+
+        self.devices = OrderedDict((b, topology.pci_device_name(b))
+                                   for b in bdfs)
+        self.ports = (SwitchtecPorts(switchtec_devices, bdfs)
+                      if switchtec_devices else None)
+        self.last = {}
+
+    def next(self):
+        super().next()
+
+        rates = self.ports.rates() if self.ports else {}
+
+        ret = OrderedDict()
+        for bdf, name in self.devices.items():
+            size, avail, published = p2pmem_stats(bdf)
+            used = size - avail
+
+            s = OrderedDict()
+            s["size"] = size
+            s["used"] = used
+            s["used_pct"] = used / size if size else 0
+            s["alloc_rate"] = ((used - self.last[bdf]) / self.duration
+                               if bdf in self.last and self.duration else 0)
+            s["published"] = published
+            if self.ports:
+                s["ingress_rate"], s["egress_rate"] = rates.get(bdf, (0, 0))
+
+            self.last[bdf] = used
+            ret[name] = s
+
+        self.latest = ret
+        return ret
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}P2P Memory:{c.rst}".format(indent, c=colours))
+        indent += "  "
+
+        for name, s in stats.items():
+            print("{}{:<30} used:  {:>7.1f} of {:.1f}  \t{:>7.1%}  {}".
+                  format(indent, name, Suffix(s["used"]), Suffix(s["size"]),
+                         s["used_pct"],
+                         "published" if s["published"] else
+                         "not published"))
+            print("{}{:<30} alloc: {:>7.1f}".
+                  format(indent, "", Suffix(s["alloc_rate"], unit="B/s")))
+
+            if "ingress_rate" in s:
+                print("{}{:<30} port:  {:>7.1f} in\t{:>7.1f} out".
+                      format(indent, "",
+                             Suffix(s["ingress_rate"], unit="B/s"),
+                             Suffix(s["egress_rate"], unit="B/s")))
+
+    def csv(self):
+        return tuple(x for y in self.latest.values() for x in y.values())
+
+    def csv_titles(self):
+        return tuple("{}:{}".format(n, x) for n, y in self.latest.items()
+                     for x in y.keys())
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    tl = P2pmemTimeline(period=2.0, devices=sys.argv[1:])
+
+    while True:
+        print(time.asctime())
+        tl.print_next();
+        print()
+        print()
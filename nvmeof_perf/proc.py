@@ -17,7 +17,10 @@
 
 import os
 import pty
+import gzip
+import queue
 import re
+import selectors
 import signal
 import subprocess as sp
 import sys
@@ -25,6 +28,8 @@ import threading
 import time
 import traceback
 
+from collections import deque
+
 class ProcRunnerException(Exception):
     def __str__(self):
         pr, msg = self.args
@@ -34,20 +39,145 @@ class ProcRunnerException(Exception):
         ret += "  " + " ".join(pr.exe + pr.args)
         return ret
 
-class ProcRunner(threading.Thread):
+class LogWriter(object):
+    """File-like object that writes to a log file from a background
+    thread so slow disks never hold up processing a runner's output.
+    Files ending in .gz are compressed."""
+
+    def __init__(self, fname, buffer_size=1 << 20):
+        self.name = fname
+
+        if fname.endswith(".gz"):
+            self.f = gzip.open(fname, "wt")
+        else:
+            self.f = open(fname, "w", buffering=buffer_size)
+
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="LogWriter",
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            data = [self.queue.get()]
+            while not self.queue.empty():
+                data.append(self.queue.get())
+
+            end = data.index(None) if None in data else None
+            self.f.write("".join(data[:end]))
+
+            if end is not None:
+                self.f.close()
+                return
+
+    def write(self, data):
+        self.queue.put(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+class ProcManager(object):
+    """Reads the output of every running ProcRunner from a single
+    thread. Each read goes into one reusable buffer and lines are
+    decoded straight out of it, so only partial lines left at the end
+    of a read are copied."""
+
+    chunk_size = 1 << 16
+
+    def __init__(self):
+        self.sel = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.thread = None
+
+        self.wake_r, self.wake_w = os.pipe()
+        self.sel.register(self.wake_r, selectors.EVENT_READ, None)
+
+        self.buf = bytearray(self.chunk_size)
+        self.view = memoryview(self.buf)
+
+    def add(self, runner, fd):
+        with self.lock:
+            self.pending.append((runner, fd))
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name="ProcManager",
+                                               daemon=True)
+                self.thread.start()
+
+        os.write(self.wake_w, b"\0")
+
+    def _register_pending(self):
+        os.read(self.wake_r, 4096)
+
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        for runner, fd in pending:
+            self.sel.register(fd, selectors.EVENT_READ, runner)
+
+    def _read(self, fd, runner):
+        try:
+            n = os.readv(fd, [self.view])
+        except OSError:
+            # Linux ptys return EIO once every slave fd has been closed
+            n = 0
+
+        if not n:
+            self.sel.unregister(fd)
+            os.close(fd)
+            runner._eof()
+            return
+
+        runner._feed(self.buf, self.view, n)
+
+    def run(self):
+        while True:
+            for key, events in self.sel.select():
+                if key.data is None:
+                    self._register_pending()
+                else:
+                    self._read(key.fd, key.data)
+
+manager = ProcManager()
+
+class ProcRunner(object):
     kill_sig = signal.SIGINT
 
+    # Number of output lines kept to report with any errors
+    output_history = 200
+    newline_re = re.compile(rb"\r\n|\r|\n")
+
     def __init__(self, log_file=None, print_output=False,
                  wait_for=False, *args, **kws):
         self.log_file = log_file
         self.print_output = print_output
         self.kill_me = not wait_for
         self.started = threading.Event()
+        self.done = threading.Event()
         self.exception = None
-        self.output_lines = []
+        self.output_lines = deque(maxlen=self.output_history)
+        self.phases = []
         self.args = []
+        self._partial = bytearray()
+        self._skip_lf = False
         super(ProcRunner, self).__init__(*args, **kws)
 
+    def mark_phase(self, name):
+        self.phases.append((time.time(), name))
+
     def process_line(self, line):
         self.output_lines.append(line)
 
@@ -63,46 +193,83 @@ class ProcRunner(threading.Thread):
     def finish(self):
         pass
 
-    def run(self):
+    def _dispatch(self, line):
         try:
-            master, slave = pty.openpty()
-            self.slave = slave
-
-            self.p = sp.Popen(self.exe + self.args,
-                                  stdin=sp.PIPE,
-                                  stdout=slave,
-                                  stderr=slave,
-                                  preexec_fn=os.setsid)
+            self.process_line(line)
+        except:
+            print("Exception occured while processing line:")
+            traceback.print_exc()
+
+    def _feed(self, buf, view, n):
+        # Lines may end in \r, \n or \r\n (the pty translates \n to
+        # \r\n and progress lines are often only terminated by \r)
+        start = 0
+        if self._skip_lf and buf[0] == ord("\n"):
+            start = 1
+        self._skip_lf = False
+
+        for m in self.newline_re.finditer(buf, start, n):
+            if self._partial:
+                self._partial += view[start:m.start()]
+                line = self._partial.decode(errors="replace")
+                self._partial.clear()
+            else:
+                line = str(view[start:m.start()], "utf-8", "replace")
+
+            self._dispatch(line + "\n")
+            start = m.end()
+            self._skip_lf = m.end() == n and buf[m.start()] == ord("\r")
+
+        self._partial += view[start:n]
+
+    def _eof(self):
+        if self._partial:
+            self._dispatch(self._partial.decode(errors="replace"))
+            self._partial.clear()
 
-            mf = os.fdopen(master, "U")
+        try:
+            self.finish()
+        except:
+            print("Exception occured while finishing:")
+            traceback.print_exc()
 
-            self.setup()
+        self.done.set()
 
-            while True:
-                self.started.set()
-                line = mf.readline()
+    def join(self, timeout=None):
+        return self.done.wait(timeout)
 
-                try:
-                    self.process_line(line)
-                except:
-                    print("Exception occured while processing line:")
-                    traceback.print_exc()
+    def start(self):
+        master, slave = pty.openpty()
+        self.slave = slave
 
-        except Exception as e:
-            self.started.set()
+        try:
+            self.p = sp.Popen(self.exe + self.args,
+                              stdin=sp.PIPE,
+                              stdout=slave,
+                              stderr=slave,
+                              preexec_fn=os.setsid)
+        except Exception:
             self.exception = sys.exc_info()
+            os.close(master)
+            os.close(slave)
+            self.done.set()
+            self.started.set()
+            raise
 
-    def check_started(self):
-        self.started.wait(2)
-        if self.exception:
-            self.join(5)
-            raise self.exception[1]
+        manager.add(self, master)
 
-    def start(self):
-        super(ProcRunner, self).start()
-        self.check_started()
+        try:
+            self.setup()
+        except Exception:
+            self.exception = sys.exc_info()
+            raise
+        finally:
+            self.started.set()
 
     def wait(self):
+        if getattr(self, "p", None) is None and self.exception:
+            return None
+
         if self.started.wait(2):
             killed = False
 
@@ -0,0 +1,307 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import cache
+
+import csv
+import json
+import math
+import time
+import fnmatch
+import argparse
+
+from collections import namedtuple, OrderedDict
+
+# Every value in a record is in bytes, bytes per second or seconds
+unit_prefixes = [("K", 1 << 10),
+                 ("M", 1 << 20),
+                 ("G", 1 << 30),
+                 ("T", 1 << 40)]
+
+def unit_multiplier(units):
+    if not units:
+        return 1
+
+    for p, mult in unit_prefixes:
+        if units.startswith(p + "Byte"):
+            return mult
+
+    return 1
+
+# Which way each metric should move to be an improvement, the first
+# matching pattern wins. Metrics that don't match aren't compared.
+metric_directions = [("*:ci", 0),
+                     ("*:count", 0),
+                     ("*:outliers", 0),
+                     ("rdma_bw", 1),
+                     ("rdma_iops", 1),
+                     ("fairness", 1),
+                     ("rdma_vol", 1),
+                     ("rdma_lat:*", -1),
+                     ("blk_bw", 1),
+                     ("blk_iops", 1),
+                     ("blk_vol", 1),
+                     ("blk_lat:*", -1),
+                     ("cpu_per_io:*", -1),
+                     ("mbw_stats:count", 0),
+                     ("mbw_stats:*", 1),
+                     ("*_time:duration", 0),
+                     ("*_time:real", 0),
+                     ("*_time:*", -1),
+                     ("likwid_stats:*", -1),
+                     ("socket_stats:*", -1)]
+
+def metric_direction(name):
+    for pattern, direction in metric_directions:
+        if fnmatch.fnmatchcase(name, pattern):
+            return direction
+    return 0
+
+def _is_number(x):
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+class _Scale(dict):
+    """Multiplier mapping that scales every key by the same amount"""
+
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+
+    def get(self, k, default=None):
+        return self.scale
+
+def _flatten(d, prefix, mults={}):
+    ret = OrderedDict()
+
+    for k, v in d.items():
+        name = prefix + ":" + k if prefix else k
+
+        if isinstance(v, dict):
+            ret.update(_flatten(v, name, mults.get(k, {})))
+        elif _is_number(v):
+            ret[name] = v * mults.get(k, 1)
+        elif isinstance(v, list) and v and all(_is_number(x) for x in v):
+            # Per job values are named by their index
+            for i, x in enumerate(v):
+                ret["{}:{}".format(name, i)] = x * mults.get(k, 1)
+
+    return ret
+
+def flatten(results):
+    """Flatten the result dictionary of a single test into one level of
+    metrics named by joining the nested keys with colons."""
+
+    likwid_mults = {k: unit_multiplier(u) for k, u in
+                    (results.get("likwid_units") or {}).items()}
+    lat_mults = _Scale(1e-6)
+    mults = {"likwid_stats": likwid_mults, "rdma_lat": lat_mults,
+             "blk_lat": lat_mults,
+             "clients": {c: {"rdma_lat": lat_mults}
+                         for c in results.get("clients") or {}},
+             "socket_stats": {s: likwid_mults
+                              for s in results.get("socket_stats") or {}}}
+
+    res = {k: v for k, v in results.items()
+           if k not in ("likwid_units", "trials")}
+    ret = _flatten(res, "", mults)
+
+    for name, s in (results.get("trials") or {}).items():
+        mult = ret[name] / s.mean if s.mean and name in ret else 1
+        ret[name + ":ci"] = s.ci * mult
+        ret[name + ":count"] = s.count
+        ret[name + ":outliers"] = s.outliers
+
+    return ret
+
+# Fields that identify the test point a record was measured at, any
+# the record doesn't have are left out
+record_keys = ["perftest", "size", "memory", "ioengine", "iodepth",
+               "numjobs"]
+
+def record(results, perftest, size, memory, **config):
+    ret = OrderedDict()
+    ret["timestamp"] = time.time()
+    ret.update(cache.host_identity())
+    ret["perftest"] = perftest
+    ret["size"] = size
+    ret["memory"] = memory
+    ret.update(config)
+    ret.update(flatten(results))
+
+    # The samples are kept whole for the JSON output, the CSV output
+    # only has room for the summary metrics
+    if results.get("timeline"):
+        ret["timeline"] = results["timeline"]
+
+    return ret
+
+def _record_key(r):
+    return tuple(r.get(k) for k in record_keys)
+
+def _record_point(r):
+    return " ".join(str(r[k]) for k in record_keys if k in r)
+
+def write_json(f, records):
+    json.dump(records, f, indent=1)
+    f.write("\n")
+
+def write_csv(f, records):
+    fieldnames = []
+    for r in records:
+        fieldnames += [k for k in r if k not in fieldnames and
+                       k != "timeline"]
+
+    w = csv.DictWriter(f, fieldnames, extrasaction="ignore")
+    w.writeheader()
+    w.writerows(records)
+
+def load_json(f):
+    return json.load(f)
+
+class Regression(namedtuple("Regression", ["point", "metric", "baseline",
+                                           "value", "change"])):
+    def __str__(self):
+        return ("{0.point}: {0.metric} "
+                "{0.baseline:.4g} -> {0.value:.4g} ({0.change:+.1%})".
+                format(self))
+
+def compare(baseline, records, threshold=5., thresholds={}):
+    """Return the metrics in records that got worse than the matching
+    baseline record by more than the threshold percentage. When both
+    sides carry confidence intervals the difference must also be
+    larger than their combined width to be counted."""
+
+    base = {_record_key(r): r for r in baseline}
+    ret = []
+
+    for r in records:
+        b = base.get(_record_key(r))
+        if b is None:
+            continue
+
+        for metric, value in r.items():
+            direction = metric_direction(metric)
+            if not direction or not _is_number(value):
+                continue
+
+            bval = b.get(metric)
+            if not _is_number(bval) or not bval:
+                continue
+
+            change = (value - bval) / abs(bval)
+            limit = thresholds.get(metric, threshold) / 100
+            if change * direction >= -limit:
+                continue
+
+            ci = r.get(metric + ":ci")
+            bci = b.get(metric + ":ci")
+            if _is_number(ci) and _is_number(bci):
+                if abs(value - bval) <= math.sqrt(ci**2 + bci**2):
+                    continue
+
+            ret.append(Regression(_record_point(r), metric, bval, value,
+                                  change))
+
+    return ret
+
+def parse_threshold(value):
+    metric, _, pct = value.rpartition("=")
+    if not metric:
+        raise ValueError("Expected METRIC=PCT: '{}'".format(value))
+    return metric, float(pct)
+
+def add_arguments(p, converge="the bandwidth and latency"):
+    """Add the options for repeating tests, caching their results and
+    saving and comparing the records to an argparse parser."""
+
+    g = p.add_argument_group("trials and results")
+    g.add_argument("-n", "--trials", type=int, default=1,
+                   help="maximum number of times to repeat each test, "
+                        "default: %(default)s")
+    g.add_argument("--min-trials", type=int, default=3,
+                   help="minimum number of trials to run before stopping "
+                        "early on --ci-width, default: %(default)s")
+    g.add_argument("--ci-width", type=float, metavar="PCT",
+                   help="stop repeating a test once the 95%% confidence "
+                        "interval of {} is within PCT percent of the "
+                        "mean".format(converge))
+    g.add_argument("--cache-dir", default=cache.default_path,
+                   help="directory to store completed results in so an "
+                        "interrupted sweep can be resumed, "
+                        "default: %(default)s")
+    g.add_argument("--no-cache", action="store_true",
+                   help="don't read or write cached results")
+    g.add_argument("-f", "--force", action="store_true",
+                   help="rerun tests that already have cached results")
+    g.add_argument("--json", type=argparse.FileType('w'), metavar="FILE",
+                   help="write every result to a JSON file (values in "
+                        "bytes, bytes/s and seconds)")
+    g.add_argument("--csv", type=argparse.FileType('w'), metavar="FILE",
+                   help="write every result to a CSV file")
+    g.add_argument("--compare", type=argparse.FileType('r'), metavar="FILE",
+                   help="compare the results with a baseline previously "
+                        "written with --json and exit with an error if "
+                        "any metric regressed")
+    g.add_argument("--threshold", type=float, default=5., metavar="PCT",
+                   help="percent change considered a regression for "
+                        "--compare, default: %(default)s")
+    g.add_argument("--metric-threshold", type=parse_threshold, default=[],
+                   action="append", metavar="METRIC=PCT",
+                   help="regression threshold for a specific metric")
+
+def pop_options(opts):
+    """Take the options added by add_arguments that aren't passed on to
+    the tests out of a dictionary of parsed options, opening the results
+    cache (unless disabled) in their place. Returns the arguments for
+    report()."""
+
+    cache_dir = opts.pop("cache_dir")
+    if not opts.pop("no_cache"):
+        opts["cache"] = cache.ResultsCache(cache_dir)
+
+    return {"json_file": opts.pop("json"),
+            "csv_file": opts.pop("csv"),
+            "baseline": opts.pop("compare"),
+            "threshold": opts.pop("threshold"),
+            "thresholds": opts.pop("metric_threshold")}
+
+def report(records, json_file=None, csv_file=None, baseline=None,
+           threshold=5., thresholds=[]):
+    """Write the records to the JSON and CSV files and compare them with
+    the baseline, printing any regressions. Returns False if there were
+    any."""
+
+    if json_file:
+        write_json(json_file, records)
+    if csv_file:
+        write_csv(csv_file, records)
+
+    if not baseline:
+        return True
+
+    regs = compare(load_json(baseline), records, threshold,
+                   dict(thresholds))
+
+    print()
+    if not regs:
+        print("No regressions found against {}".format(baseline.name))
+        return True
+
+    print("Regressions against {}:".format(baseline.name))
+    for r in regs:
+        print("  {}".format(r))
+
+    return False
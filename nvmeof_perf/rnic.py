@@ -15,7 +15,7 @@
 ##
 ########################################################################
 
-from. import colours, utils
+from. import colours, topology, utils
 from .suffix import Suffix
 
 import os
@@ -98,6 +98,7 @@ class RnicTimeline(utils.Timeline):
         super().__init__(*args, **kwargs)
 
         self.devices = devices
+        self.links = topology.pcie_links(devices)
         self.last = None
         self.last_read = None
 
@@ -123,10 +124,14 @@ class RnicTimeline(utils.Timeline):
             tx_rate = tx / duration if duration else 0
             rx_rate = rx / duration if duration else 0
 
-            ret[d] = tx, rx, tx_rate, rx_rate
+            tx_link = topology.link_utilization(self.links[d], tx_rate)
+            rx_link = topology.link_utilization(self.links[d], rx_rate)
+
+            ret[d] = tx, rx, tx_rate, rx_rate, tx_link, rx_link
 
         self.latest = ret
-        self.latest_titles = ["tx", "rx", "tx_rate", "rx_rate"]
+        self.latest_titles = ["tx", "rx", "tx_rate", "rx_rate",
+                              "tx_link_pct", "rx_link_pct"]
 
         return ret
 
@@ -136,7 +141,8 @@ class RnicTimeline(utils.Timeline):
         print("{}{c.bold}RNIC Stats:{c.rst}".format(indent, c=colours))
         indent += "  "
 
-        for d, (tx, rx, tx_rate, rx_rate) in stats.items():
+        for d, (tx, rx, tx_rate, rx_rate, tx_link, rx_link) in stats.items():
+            link = self.links[d]
             tx = Suffix(tx)
             rx = Suffix(rx)
             tx_rate = Suffix(tx_rate, unit="B/s")
@@ -147,6 +153,11 @@ class RnicTimeline(utils.Timeline):
             print("{}{:<30} rx:    {:>7.1f}  \t{:>7.1f}".
                   format(indent, "", rx, rx_rate))
 
+            if link:
+                topology.print_link(link, indent)
+                print("{}{:<30} util:  {:>7.1%} tx\t{:>7.1%} rx".
+                      format(indent, "", tx_link, rx_link))
+
     def csv(self):
         return tuple(x for y in self.latest.values() for x in y)
 
@@ -0,0 +1,186 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, utils
+from .suffix import Suffix
+
+import os
+import re
+
+from collections import OrderedDict
+
+# Softirqs that do the completion processing for NVMe-oF and RDMA, which
+# are also split out per CPU
+default_types = ["NET_RX", "BLOCK", "IRQ_POLL", "TASKLET"]
+
+def softirq_stats(path="/proc/softirqs"):
+    """Return the CPU numbers and the per-CPU counts of each softirq."""
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    cpus = [int(c[3:]) for c in lines[0].split()]
+    ret = OrderedDict()
+    for l in lines[1:]:
+        name, _, counts = l.partition(":")
+        ret[name.strip()] = [int(x) for x in counts.split()[:len(cpus)]]
+
+    return cpus, ret
+
+def ksoftirqd_threads():
+    """Map each CPU to the pid of its ksoftirqd thread."""
+
+    ret = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+
+        try:
+            with open(os.path.join("/proc", pid, "comm")) as f:
+                comm = f.read().strip()
+        except IOError:
+            continue
+
+        m = re.match(r"^ksoftirqd/(\d+)$", comm)
+        if m:
+            ret[int(m.group(1))] = int(pid)
+
+    return ret
+
+def thread_cpu_time(pid):
+    """User and system time of a thread in seconds."""
+
+    with open("/proc/{}/stat".format(pid)) as f:
+        # The command may contain spaces so count from after it
+        fields = f.read().rpartition(")")[2].split()
+
+    return ((int(fields[11]) + int(fields[12])) /
+            os.sysconf(os.sysconf_names['SC_CLK_TCK']))
+
+class SoftirqTimeline(utils.Timeline):
+    """Rate of each type of softirq in total and per CPU for the given
+    types, along with the share of each CPU spent in its ksoftirqd
+    thread (and the sum of those over every CPU). Time in ksoftirqd
+    means softirq work is being deferred from the interrupts that
+    raised it."""
+
+    def __init__(self, types=default_types, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.types = types
+        self.threads = ksoftirqd_threads()
+        self.last = None
+        self.last_threads = None
+
+    def _thread_times(self):
+        ret = {}
+        for cpu, pid in self.threads.items():
+            try:
+                ret[cpu] = thread_cpu_time(pid)
+            except IOError:
+                ret[cpu] = 0
+        return ret
+
+    def next(self):
+        super().next()
+
+        cpus, stats_new = softirq_stats()
+        threads_new = self._thread_times()
+
+        if self.last:
+            stats = OrderedDict((t, [a - b for a, b in
+                                     zip(c, self.last.get(t, c))])
+                                for t, c in stats_new.items())
+            threads = {c: t - self.last_threads.get(c, t)
+                       for c, t in threads_new.items()}
+        else:
+            stats = stats_new
+            threads = {c: 0 for c in threads_new}
+
+        self.last = stats_new
+        self.last_threads = threads_new
+        self.cpus = cpus
+
+        def rate(x):
+            return x / self.duration if self.duration else 0
+
+        total = OrderedDict()
+        for t, c in stats.items():
+            total[t + "_rate"] = rate(sum(c))
+        # Summed over the CPUs, so this can pass 100%
+        total["ksoftirqd_pct"] = rate(sum(threads.values()))
+
+        ret = OrderedDict([("softirq", total)])
+        for i, cpu in enumerate(cpus):
+            s = OrderedDict()
+            for t in self.types:
+                if t in stats:
+                    s[t + "_rate"] = rate(stats[t][i])
+            s["ksoftirqd_pct"] = rate(threads.get(cpu, 0))
+            ret["cpu{}".format(cpu)] = s
+
+        self.latest = ret
+        return ret
+
+    def print_next(self, indent=""):
+        stats = self.next()
+
+        print("{}{c.bold}Softirqs:{c.rst}".format(indent, c=colours))
+        indent += "  "
+
+        for name, value in stats["softirq"].items():
+            if name == "ksoftirqd_pct":
+                continue
+            print("{}{:<35} {:>9.1f}".format(indent, name[:-5] + ":",
+                  Suffix(value, unit="/s", decimal=True)))
+
+        print("{}{:<35} {:>9.1%}".format(indent, "ksoftirqd:",
+                                          stats["softirq"]["ksoftirqd_pct"]))
+
+        # Only show the CPUs doing any of this work
+        rows = [(name, s) for name, s in list(stats.items())[1:]
+                if any(s.values())]
+        if not rows:
+            return
+
+        print()
+        types = [t for t in self.types if t + "_rate" in stats["softirq"]]
+        print("{}{:<8}".format(indent, "") +
+              "".join("{:>12}".format(t) for t in types) +
+              "{:>12}".format("ksoftirqd"))
+
+        for name, s in rows:
+            print("{}{:<8}".format(indent, name) +
+                  "".join("{:>12.0f}".format(s[t + "_rate"]) for t in types) +
+                  "{:>12.1%}".format(s["ksoftirqd_pct"]))
+
+    def csv(self):
+        return tuple(x for y in self.latest.values() for x in y.values())
+
+    def csv_titles(self):
+        return tuple("{}:{}".format(n, x) for n, y in self.latest.items()
+                     for x in y.keys())
+
+if __name__ == "__main__":
+    import time
+
+    tl = SoftirqTimeline(period=2.0)
+
+    while True:
+        print(time.asctime())
+        tl.print_next();
+        print()
+        print()
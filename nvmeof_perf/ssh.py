@@ -0,0 +1,86 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+import os
+import shutil
+import tempfile
+import subprocess as sp
+
+_masters = {}
+
+class SSHException(Exception):
+    pass
+
+class SSHMaster(object):
+    """Persistent ssh connection that any ssh command built with
+    command() for the same host is multiplexed over, so each command
+    skips the handshake and authentication."""
+
+    def __init__(self, host, persist=600):
+        self.host = host
+        self.persist = persist
+        self.dir = None
+        self.control_path = None
+
+    def opts(self):
+        return ["-o", "ControlPath={}".format(self.control_path)]
+
+    def start(self):
+        self.dir = tempfile.mkdtemp(prefix="nvmeof-perf-ssh-")
+        self.control_path = os.path.join(self.dir, "ctl")
+
+        ret = sp.call(["ssh", "-f", "-N", "-o", "ControlMaster=yes",
+                       "-o", "ControlPersist={}".format(self.persist)] +
+                      self.opts() +
+                      [self.host])
+        if ret:
+            self.cleanup()
+            raise SSHException("Unable to connect to {}".format(self.host))
+
+        _masters[self.host] = self
+
+    def run(self, args, **kwargs):
+        return sp.call(command(self.host) + args, **kwargs)
+
+    def stop(self):
+        if _masters.get(self.host) is self:
+            del _masters[self.host]
+
+        sp.call(["ssh", "-O", "exit"] + self.opts() + [self.host],
+                stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        self.cleanup()
+
+    def cleanup(self):
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+def command(host):
+    """Return the command to run something on host over ssh, using the
+    host's master connection if one has been started."""
+
+    m = _masters.get(host)
+    if m is None:
+        return ["ssh", host]
+
+    return ["ssh", "-o", "ControlMaster=no"] + m.opts() + [host]
@@ -0,0 +1,208 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import fio
+
+import math
+
+from collections import namedtuple, OrderedDict
+
+# Two sided 95% critical values of Student's t distribution for 1 to 30
+# degrees of freedom. Anything larger uses the normal approximation.
+_t95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+        2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+        2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+        2.048, 2.045, 2.042]
+
+def t_value(dof):
+    if dof < 1:
+        return float("inf")
+    if dof <= len(_t95):
+        return _t95[dof - 1]
+    return 1.960
+
+class Summary(namedtuple("Summary", ["mean", "ci", "stdev", "count",
+                                     "outliers", "min", "max"])):
+    def rel_ci(self):
+        if not self.mean:
+            return 0. if not self.ci else float("inf")
+        return self.ci / abs(self.mean)
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+def count_outliers(values, threshold=3.5):
+    # Modified z-score (Iglewicz and Hoaglin) which, unlike the standard
+    # deviation, isn't dragged around by the outliers themselves.
+    if len(values) < 3:
+        return 0
+
+    med = median(values)
+    mad = median([abs(v - med) for v in values])
+    if not mad:
+        return 0
+
+    return sum(1 for v in values if 0.6745 * abs(v - med) / mad > threshold)
+
+def summarize(values):
+    n = len(values)
+    mean = sum(values) / n
+
+    if n > 1:
+        stdev = math.sqrt(sum((v - mean)**2 for v in values) / (n - 1))
+        ci = t_value(n - 1) * stdev / math.sqrt(n)
+    else:
+        stdev = 0.
+        ci = float("inf")
+
+    return Summary(mean=mean, ci=ci, stdev=stdev, count=n,
+                   outliers=count_outliers(values),
+                   min=min(values), max=max(values))
+
+def _is_number(x):
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+def combine_timelines(timelines):
+    """Join the timelines recorded during each trial into one, with a
+    column after the phase giving the trial each sample came from.
+    The samples of any trial whose timeline recorded different columns
+    to the rest are left out."""
+
+    timelines = [(i, t) for i, t in enumerate(timelines) if t]
+    if not timelines:
+        return None
+
+    titles = next((t["titles"] for i, t in timelines if t["samples"]),
+                  timelines[0][1]["titles"])
+    ret = {"titles": titles[:2] + ["trial"] + titles[2:],
+           "phases": [],
+           "samples": []}
+
+    for i, t in timelines:
+        ret["phases"] += t["phases"]
+        if t["titles"] == titles:
+            ret["samples"] += [s[:2] + [i] + s[2:] for s in t["samples"]]
+
+    return ret
+
+def combine_results(runs):
+    """Merge a list of result dictionaries into a single dictionary
+    of the same shape holding the mean of every numeric field. A Summary
+    for each field is stored under the "trials" key, named by joining
+    the nested keys with colons. The timelines of every trial are
+    joined rather than averaged, as are the latency histograms (any
+    field ending in _hist) which the latency percentiles next to them
+    are then taken from."""
+
+    summaries = OrderedDict()
+
+    def hist_percentiles(d, name):
+        # Percentiles can't be averaged, take them from the histogram
+        # merged over every trial
+        for k, hist in d.items():
+            lat = d.get(k[:-len("_hist")])
+            if not k.endswith("_hist") or not hist or not isinstance(lat,
+                                                                     dict):
+                continue
+
+            for p, v in fio.hist_percentiles(hist).items():
+                if p not in lat:
+                    continue
+                lat[p] = v
+                key = ":".join(name + [k[:-len("_hist")], p])
+                if key in summaries:
+                    summaries[key] = summaries[key]._replace(mean=v)
+
+    def merge(values, name):
+        values = [v for v in values if v is not None]
+        if not values:
+            return None
+
+        if isinstance(values[0], dict):
+            keys = []
+            for v in values:
+                keys += [k for k in v if k not in keys]
+
+            ret = {k: merge([v.get(k) for v in values], name + [k])
+                   for k in keys}
+            hist_percentiles(ret, name)
+            return ret
+
+        if name[-1].endswith("_hist"):
+            return fio.merge_hists(values)
+
+        if (all(isinstance(v, list) for v in values) and
+            all(_is_number(x) for v in values for x in v) and
+            len(set(len(v) for v in values)) == 1):
+            return [merge([v[i] for v in values], name + [str(i)])
+                    for i in range(len(values[0]))]
+
+        if _is_number(values[0]):
+            values = [v for v in values if _is_number(v)]
+            s = summarize(values)
+            summaries[":".join(name)] = s
+            return s.mean
+
+        return values[0]
+
+    ret = {k: merge([r.get(k) for r in runs], [k]) for k in runs[0]
+           if k != "timeline"}
+    hist_percentiles(ret, [])
+    if "timeline" in runs[0]:
+        ret["timeline"] = combine_timelines(r.get("timeline") for r in runs)
+    ret["trials"] = summaries
+    return ret
+
+def converged(results, metrics, rel_width):
+    """Return True once the confidence interval of every one of the
+    given metrics is within rel_width of its mean. Metrics that the
+    test doesn't report are ignored."""
+
+    for m in metrics:
+        s = results["trials"].get(m)
+        if s is None:
+            continue
+        if s.rel_ci() > rel_width:
+            return False
+
+    return True
+
+def run_trials(run, metrics, trials=1, min_trials=3, ci_width=None,
+               **kwargs):
+    """Call run(trial=n, **kwargs) up to trials times and combine the
+    results. With ci_width set, stop early once at least min_trials
+    have run and the given metrics have converged to within ci_width
+    percent."""
+
+    if trials <= 1:
+        return run(**kwargs)
+
+    runs = []
+    while len(runs) < trials:
+        runs.append(run(trial=len(runs), **kwargs))
+
+        if ci_width is None or len(runs) < min_trials:
+            continue
+
+        res = combine_results(runs)
+        if converged(res, metrics, ci_width / 100):
+            return res
+
+    return combine_results(runs)
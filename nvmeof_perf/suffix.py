@@ -51,7 +51,7 @@ class Suffix(object):
         suffix_values = suffix_dec_values if decimal else suffix_bin_values
 
         for s, v in suffix_values[::-1]:
-            if value < v:
+            if abs(value) < v:
                 continue
             if s and not decimal:
                 s+= "i"
@@ -148,6 +148,18 @@ class Switchtec(object):
 
         return ret
 
+    def status_report(self):
+        ret = []
+        for s in self.status():
+            ret.append("Port {:>2} (phys {:>2}) {:<4} x{}/x{} Gen{} {:<16} {}".
+                       format(s.port.log_id, s.port.phys_id,
+                              "up" if s.link_up else "down",
+                              s.neg_link_width, s.cfg_link_width,
+                              s.link_rate,
+                              (s.ltssm_str or b"").decode(),
+                              (s.pci_dev or b"").decode()))
+        return ret
+
     def bwcntr_many(self, port_ids, reset=False):
         bwdata = (SwitchtecBwCntrRes * len(port_ids))()
         ids = (c.c_int * len(port_ids))(*port_ids)
@@ -0,0 +1,319 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import colours, likwid
+from .suffix import Suffix
+
+import os
+import re
+import stat
+
+from collections import namedtuple
+
+class TopologyException(Exception):
+    pass
+
+bdf_re = re.compile(r"^[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]$")
+
+# Where each kind of device shows up by name in sysfs
+class_dirs = ["infiniband", "net", "block", "p2pmem", "switchtec", "nvme"]
+
+class DeviceLocation(namedtuple("DeviceLocation", ["name", "sysfs",
+                                                   "pci_path", "numa_node",
+                                                   "socket", "cpus"])):
+    def pci_device(self):
+        return self.pci_path[-1] if self.pci_path else None
+
+    def __str__(self):
+        node = "?" if self.numa_node is None else self.numa_node
+        sock = "?" if self.socket is None else "S{}".format(self.socket)
+        return "{:<14} node {:<2} {:<3} cpus {:<12} {}".format(
+            self.name, node, sock, format_cpulist(self.cpus) or "?",
+            " -> ".join(self.pci_path) if self.pci_path else "(not PCI)")
+
+class PcieLink(namedtuple("PcieLink", ["bdf", "speed", "width",
+                                       "max_speed", "max_width"])):
+    """Negotiated and maximum link of a PCIe function, speeds in GT/s."""
+
+    # Transfer rate of each generation in GT/s
+    generations = {2.5: 1, 5.0: 2, 8.0: 3, 16.0: 4, 32.0: 5, 64.0: 6}
+
+    @staticmethod
+    def _bandwidth(speed, width):
+        # Gen1 and Gen2 use 8b/10b encoding, later ones 128b/130b
+        encoding = 8 / 10 if speed < 8 else 128 / 130
+        return speed * 1e9 * encoding * width / 8
+
+    def bandwidth(self):
+        """Usable bytes per second in each direction."""
+        return self._bandwidth(self.speed, self.width)
+
+    def max_bandwidth(self):
+        return self._bandwidth(self.max_speed, self.max_width)
+
+    def downtrained(self):
+        return self.speed < self.max_speed or self.width < self.max_width
+
+    @classmethod
+    def _name(cls, speed, width):
+        gen = cls.generations.get(speed)
+        gen = "Gen{}".format(gen) if gen else "{}GT/s".format(speed)
+        return "{} x{}".format(gen, width)
+
+    def __str__(self):
+        return self._name(self.speed, self.width)
+
+    def max_str(self):
+        return self._name(self.max_speed, self.max_width)
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+def parse_cpulist(text):
+    ret = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            a, b = part.split("-")
+            ret += range(int(a), int(b) + 1)
+        else:
+            ret.append(int(part))
+    return ret
+
+def format_cpulist(cpus):
+    ranges = []
+    for c in sorted(cpus):
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+
+    return ",".join(str(a) if a == b else "{}-{}".format(a, b)
+                    for a, b in ranges)
+
+def sysfs_path(device):
+    """Find the sysfs directory of a device given by name (mlx5_0,
+    nvme0n1, switchtec0), device node (/dev/p2pmem0), PCI address or
+    a file in the device's sysfs directory (eg. a BAR resource)."""
+
+    if device.startswith("/sys/") and os.path.exists(device):
+        path = os.path.realpath(device)
+        return path if os.path.isdir(path) else os.path.dirname(path)
+
+    if bdf_re.match(device):
+        path = os.path.join("/sys/bus/pci/devices", device)
+        if os.path.exists(path):
+            return os.path.realpath(path)
+
+    if os.path.exists(device) and device.startswith("/dev/"):
+        st = os.stat(device)
+        kind = "block" if stat.S_ISBLK(st.st_mode) else "char"
+        path = os.path.join("/sys/dev", kind, "{}:{}".format(
+            os.major(st.st_rdev), os.minor(st.st_rdev)))
+        if os.path.exists(path):
+            return os.path.realpath(path)
+
+    name = os.path.basename(device)
+    for c in class_dirs:
+        path = os.path.join("/sys/class", c, name)
+        if os.path.exists(path):
+            return os.path.realpath(path)
+
+    raise TopologyException("Device not found in sysfs: {}".format(device))
+
+def pci_path(path):
+    """Return the PCI addresses from the root port down to the device
+    that owns the given sysfs directory."""
+
+    return [p for p in path.split(os.sep) if bdf_re.match(p)]
+
+def pci_device_name(bdf, classes=["nvme", "infiniband", "net"]):
+    """Name a PCI function after the first device of the given classes
+    its driver created, or its address if it has none."""
+
+    for c in classes:
+        try:
+            return sorted(os.listdir(os.path.join("/sys/bus/pci/devices",
+                                                  bdf, c)))[0]
+        except (OSError, IndexError):
+            pass
+    return bdf
+
+def node_cpus(node):
+    return parse_cpulist(_read("/sys/devices/system/node/node{}/cpulist".
+                               format(node)))
+
+def cpu_nodes():
+    """Map every CPU to its NUMA node."""
+
+    ret = {}
+    try:
+        nodes = os.listdir("/sys/devices/system/node")
+    except OSError:
+        return ret
+
+    for n in nodes:
+        m = re.match(r"^node(\d+)$", n)
+        if m:
+            for c in node_cpus(int(m.group(1))):
+                ret[c] = int(m.group(1))
+    return ret
+
+def locate(device):
+    path = sysfs_path(device)
+    bdfs = pci_path(path)
+
+    numa_node = None
+    cpus = []
+    if bdfs:
+        pci_dir = os.path.join("/sys/bus/pci/devices", bdfs[-1])
+        try:
+            numa_node = int(_read(os.path.join(pci_dir, "numa_node")))
+        except (IOError, ValueError):
+            pass
+
+        # Firmware that doesn't describe the locality reports -1
+        if numa_node is not None and numa_node < 0:
+            numa_node = None
+
+        try:
+            cpus = parse_cpulist(_read(os.path.join(pci_dir,
+                                                    "local_cpulist")))
+        except IOError:
+            pass
+
+    if numa_node is not None and not cpus:
+        try:
+            cpus = node_cpus(numa_node)
+        except IOError:
+            pass
+
+    # Without a NUMA node the local CPUs are every CPU, so this only
+    # picks a socket if there's just one
+    try:
+        sockets = set(likwid.cpu_socket(c) for c in cpus)
+    except (IOError, ValueError):
+        sockets = set()
+    socket = sockets.pop() if len(sockets) == 1 else None
+
+    return DeviceLocation(os.path.basename(device), path, bdfs, numa_node,
+                          socket, cpus)
+
+def locate_all(devices):
+    ret = []
+    for d in devices:
+        try:
+            ret.append(locate(d))
+        except TopologyException:
+            pass
+    return ret
+
+def _link_speed(text):
+    # eg. "8.0 GT/s PCIe" or "Unknown"
+    return float(text.split()[0])
+
+def pcie_link(device):
+    """Return the link of the PCIe function behind a device or None if
+    it isn't PCI or its link isn't reported (as in most VMs)."""
+
+    bdfs = pci_path(sysfs_path(device))
+    if not bdfs:
+        return None
+
+    pci_dir = os.path.join("/sys/bus/pci/devices", bdfs[-1])
+    try:
+        return PcieLink(bdfs[-1],
+            _link_speed(_read(os.path.join(pci_dir, "current_link_speed"))),
+            int(_read(os.path.join(pci_dir, "current_link_width"))),
+            _link_speed(_read(os.path.join(pci_dir, "max_link_speed"))),
+            int(_read(os.path.join(pci_dir, "max_link_width"))))
+    except (IOError, ValueError, IndexError):
+        return None
+
+def pcie_links(devices):
+    """Map each device to its PCIe link (or None) for the timelines,
+    which only read it once as it doesn't normally change."""
+
+    ret = {}
+    for d in devices:
+        try:
+            ret[d] = pcie_link(d)
+        except TopologyException:
+            ret[d] = None
+    return ret
+
+def link_utilization(link, rate):
+    if link is None:
+        return float("nan")
+    return rate / link.bandwidth()
+
+def print_link(link, indent=""):
+    if link is None:
+        return
+
+    print("{}{:<30} link:  {}  ({:.1f}/s per direction)".
+          format(indent, "", link, Suffix(link.bandwidth())))
+    if link.downtrained():
+        print("{}{:<30} {c.bold}Warning:{c.rst} link downtrained from {}".
+              format(indent, "", link.max_str(), c=colours))
+
+def rdma_devices():
+    try:
+        return sorted(os.listdir("/sys/class/infiniband"))
+    except OSError:
+        return []
+
+def auto_socket(devices):
+    """Return the socket local to the first of the devices whose
+    locality is known and that device's location, or (None, None)."""
+
+    for d in devices:
+        try:
+            loc = locate(d)
+        except TopologyException:
+            continue
+        if loc.socket is not None:
+            return loc.socket, loc
+
+    return None, None
+
+def print_topology(devices, indent=""):
+    locs = locate_all(devices)
+    if not locs:
+        return
+
+    print("{}{c.bold}Topology:{c.rst}".format(indent, c=colours))
+    for loc in locs:
+        print("{}  {}".format(indent, loc))
+
+        link = pcie_link(loc.sysfs)
+        if link and link.downtrained():
+            print("{}    {c.bold}Warning:{c.rst} PCIe link is {}, "
+                  "downtrained from {}".format(indent, link, link.max_str(),
+                                               c=colours))
+
+    sockets = set(l.socket for l in locs if l.socket is not None)
+    if len(sockets) > 1:
+        print("{}  {c.bold}Warning:{c.rst} devices are on different "
+              "sockets".format(indent, c=colours))
+
+if __name__ == "__main__":
+    import sys
+
+    print_topology(sys.argv[1:] or rdma_devices())
@@ -0,0 +1,271 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import switchtec
+
+import os
+import re
+import csv
+import time
+import fnmatch
+import threading
+
+from collections import deque
+
+class TriggerException(Exception):
+    pass
+
+class Condition(object):
+    """One test against every metric matching a pattern:
+
+        PATTERN<VALUE    below an absolute value
+        PATTERN>VALUE    above an absolute value
+        PATTERN-PCT%     dropped by more than PCT percent
+        PATTERN+PCT%     risen by more than PCT percent
+
+    Changes are relative to the mean of the metric over the samples
+    held before the current one. The condition holds if any matching
+    metric passes the test."""
+
+    cond_re = re.compile(r"^(?P<pattern>.+?)\s*"
+                         r"(?:(?P<op>[<>])\s*(?P<value>[-+0-9.e]+)|"
+                         r"(?P<dir>[-+])(?P<pct>[0-9.]+)%)$")
+
+    def __init__(self, text):
+        m = self.cond_re.match(text.strip())
+        if not m:
+            raise TriggerException("Invalid trigger condition: '{}'".
+                                   format(text))
+
+        self.text = text.strip()
+        self.pattern = m.group("pattern")
+        self.op = m.group("op") or m.group("dir")
+        self.value = float(m.group("value") or m.group("pct"))
+        self.columns = None
+
+    def bind(self, titles):
+        self.columns = [(i, t) for i, t in enumerate(titles)
+                        if fnmatch.fnmatchcase(t, self.pattern)]
+        if not self.columns:
+            raise TriggerException("No metric matches '{}'".
+                                   format(self.pattern))
+
+    def _check(self, value, history):
+        if self.op == "<":
+            return value < self.value
+        if self.op == ">":
+            return value > self.value
+
+        if not history:
+            return False
+
+        base = sum(history) / len(history)
+        if not base:
+            return False
+
+        change = (value - base) / abs(base) * 100
+        if self.op == "-":
+            return change < -self.value
+        return change > self.value
+
+    def check(self, sample, samples):
+        """Return the titles of the metrics that pass in sample."""
+
+        return [t for i, t in self.columns
+                if self._check(sample[i], [s[i] for s in samples])]
+
+class Rule(object):
+    """Conditions joined with '&' that must all hold at once."""
+
+    def __init__(self, text):
+        self.text = text
+        self.conditions = [Condition(c) for c in text.split("&")]
+
+    def bind(self, titles):
+        for c in self.conditions:
+            c.bind(titles)
+
+    def check(self, sample, samples):
+        ret = []
+        for c in self.conditions:
+            matched = c.check(sample, samples)
+            if not matched:
+                return None
+            ret += matched
+
+        return ret
+
+def snapshot_interrupts():
+    with open("/proc/interrupts") as f:
+        return f.read()
+
+def snapshot_switchtec(devpath):
+    return "\n".join(switchtec.Switchtec(devpath).status_report()) + "\n"
+
+class TriggerCapture(threading.Thread):
+    """Sample a set of timelines at a high rate into a buffer holding
+    the last pre seconds. When any rule matches, keep sampling for post
+    seconds and then write the whole window to a new directory under
+    out_dir, along with snapshots of /proc/interrupts and the status of
+    the given Switchtec devices taken at the trigger."""
+
+    def __init__(self, timelines, rules, pre=10., post=10., out_dir=".",
+                 snapshot=False, switchtec_devices=[]):
+        super().__init__(daemon=True)
+
+        self.timelines = timelines
+        self.rules = [Rule(r) for r in rules]
+        self.period = timelines[0].period
+        self.pre = deque(maxlen=max(int(pre / self.period), 1))
+        self.post_count = max(int(post / self.period), 1)
+        self.out_dir = out_dir
+        self.snapshot = snapshot
+        self.switchtec_devices = switchtec_devices
+
+        self.titles = None
+        self.stopped = threading.Event()
+        self.exception = None
+        self.captures = []
+        self.pending = None
+
+    def _trigger(self, tm, rule, matched):
+        self.pending = {"time": tm, "rule": rule.text, "matched": matched,
+                        "pre": list(self.pre), "post": [], "snapshots": {}}
+
+        if not self.snapshot:
+            return
+
+        snaps = self.pending["snapshots"]
+        try:
+            snaps["interrupts.txt"] = snapshot_interrupts()
+        except IOError as e:
+            snaps["interrupts.txt"] = str(e) + "\n"
+
+        for dev in self.switchtec_devices:
+            name = "{}.txt".format(os.path.basename(dev))
+            try:
+                snaps[name] = snapshot_switchtec(dev)
+            except (OSError, switchtec.SwitchtecError) as e:
+                snaps[name] = str(e) + "\n"
+
+    def _dump(self):
+        p = self.pending
+        self.pending = None
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(p["time"]))
+        path = os.path.join(self.out_dir, "trigger-{}-{}".
+                            format(stamp, len(self.captures)))
+        os.makedirs(path, exist_ok=True)
+
+        with open(os.path.join(path, "trigger.txt"), "w") as f:
+            print("time:    {} ({})".format(time.ctime(p["time"]),
+                                            p["time"]), file=f)
+            print("rule:    {}".format(p["rule"]), file=f)
+            print("matched: {}".format(", ".join(p["matched"])), file=f)
+            print("window:  {} samples before, {} after, every {}s".
+                  format(len(p["pre"]), len(p["post"]), self.period), file=f)
+
+        with open(os.path.join(path, "samples.csv"), "w") as f:
+            w = csv.writer(f)
+            w.writerow(["timestamp", "trigger"] + self.titles)
+            for s in p["pre"]:
+                w.writerow([s[0], 0] + s[1:])
+            for i, s in enumerate(p["post"]):
+                w.writerow([s[0], int(i == 0)] + s[1:])
+
+        for name, data in p["snapshots"].items():
+            with open(os.path.join(path, name), "w") as f:
+                f.write(data)
+
+        self.captures.append(path)
+        self.pre.clear()
+
+    def _sample(self):
+        for tl in self.timelines:
+            tl.next()
+
+        sample = [time.time()] + [x for tl in self.timelines
+                                  for x in tl.csv()]
+
+        if self.titles is None:
+            self.titles = [t for tl in self.timelines
+                           for t in tl.csv_titles()]
+            for r in self.rules:
+                r.bind(self.titles)
+
+        return sample
+
+    def run(self):
+        try:
+            self._sample()
+            while not self.stopped.is_set():
+                sample = self._sample()
+                values = sample[1:]
+
+                if self.pending:
+                    self.pending["post"].append(sample)
+                    if len(self.pending["post"]) >= self.post_count:
+                        self._dump()
+                    continue
+
+                # Only arm once there's a full window to save before
+                # the trigger (and to compare changes against)
+                if len(self.pre) < self.pre.maxlen:
+                    self.pre.append(sample)
+                    continue
+
+                prev = [s[1:] for s in self.pre]
+                for r in self.rules:
+                    matched = r.check(values, prev)
+                    if matched:
+                        self._trigger(sample[0], r, matched)
+                        self.pending["post"].append(sample)
+                        break
+                else:
+                    self.pre.append(sample)
+        except Exception as e:
+            self.exception = e
+
+    def status(self):
+        if self.exception:
+            return "Trigger capture failed: {}".format(self.exception)
+        if self.pending:
+            return "Trigger: capturing ({})".format(self.pending["rule"])
+        if self.captures:
+            return "Trigger: {} captured, last in {}".format(
+                len(self.captures), self.captures[-1])
+        if len(self.pre) < self.pre.maxlen:
+            return "Trigger: filling the pre-trigger window"
+        return "Trigger: armed"
+
+    def __enter__(self):
+        for tl in self.timelines:
+            tl.__enter__()
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stopped.set()
+        self.join()
+
+        if self.pending:
+            self._dump()
+
+        for tl in self.timelines:
+            tl.__exit__(type, value, traceback)
+
+        if self.exception and type is None:
+            raise self.exception
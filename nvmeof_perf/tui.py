@@ -0,0 +1,333 @@
+########################################################################
+##
+## Copyright 2018 Eidetic Communications Inc.
+##
+## Licensed under the Apache License, Version 2.0 (the "License"); you
+## may not use this file except in compliance with the License. You may
+## obtain a copy of the License at
+## http://www.apache.org/licenses/LICENSE-2.0 Unless required by
+## applicable law or agreed to in writing, software distributed under the
+## License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+## CONDITIONS OF ANY KIND, either express or implied. See the License for
+## the specific language governing permissions and limitations under the
+## License.
+##
+########################################################################
+
+from . import agent, colours, utils
+
+import os
+import sys
+import math
+import time
+import array
+import select
+import shutil
+import termios
+import threading
+import tty
+
+from collections import OrderedDict
+
+spark_chars = " ▁▂▃▄▅▆▇█"
+
+# Number of samples shown in each sparkline cell at each zoom level
+zoom_levels = [1, 2, 5, 10, 30, 60, 300, 600]
+
+class RingBuffer(object):
+    """Fixed size history of one metric held as single precision floats,
+    so an hour of one second samples costs 14 KiB per metric."""
+
+    def __init__(self, size):
+        self.data = array.array("f", [math.nan]) * size
+        self.pos = 0
+
+    def append(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.data)
+
+    def last(self, n):
+        """Return the last n values, oldest first."""
+
+        n = min(n, len(self.data))
+        start = self.pos - n
+        if start >= 0:
+            return self.data[start:self.pos]
+        return self.data[start:] + self.data[:self.pos]
+
+def _value(x):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return math.nan
+
+def sparkline(values, width, per_cell=1):
+    """Draw the last width * per_cell values as width characters, each
+    the mean of per_cell samples, scaled between the minimum and
+    maximum of the values shown."""
+
+    cells = []
+    for i in range(len(values) - width * per_cell, len(values), per_cell):
+        chunk = [v for v in values[max(i, 0):i + per_cell]
+                 if not math.isnan(v)]
+        cells.append(sum(chunk) / len(chunk) if chunk and i >= 0 else None)
+
+    known = [c for c in cells if c is not None]
+    if not known:
+        return " " * width
+
+    lo, hi = min(known), max(known)
+    top = len(spark_chars) - 1
+
+    ret = ""
+    for c in cells:
+        if c is None:
+            ret += " "
+        elif hi == lo:
+            ret += spark_chars[1 if c else 0]
+        else:
+            ret += spark_chars[1 + round((c - lo) / (hi - lo) * (top - 1))]
+
+    return ret
+
+class Group(object):
+    def __init__(self, name):
+        self.name = name
+        self.metrics = OrderedDict()
+        self.expanded = True
+
+class History(object):
+    """Ring buffered history of every metric of a set of timelines,
+    grouped by timeline and device."""
+
+    def __init__(self, timelines, size):
+        self.size = size
+        self.groups = OrderedDict()
+        self.columns = None
+        self.timelines = timelines
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _setup(self):
+        self.columns = []
+        for tl in self.timelines:
+            tl_name = type(tl).__name__.replace("Timeline", "")
+            for title in tl.csv_titles():
+                dev, _, name = title.rpartition(":")
+                gname = tl_name + (" " + dev if dev else "")
+                g = self.groups.get(gname)
+                if g is None:
+                    g = self.groups[gname] = Group(gname)
+
+                buf = RingBuffer(self.size)
+                g.metrics[title] = buf
+                self.columns.append(buf)
+
+    def add(self):
+        with self.lock:
+            if self.columns is None:
+                self._setup()
+
+            values = [x for tl in self.timelines for x in tl.csv()]
+            for buf, v in zip(self.columns, values):
+                buf.append(_value(v))
+            self.count += 1
+
+class Sampler(threading.Thread):
+    """Take a sample of every timeline each period in the background.
+    The first sample of each timeline only establishes the starting
+    counters so it isn't kept."""
+
+    def __init__(self, history, on_sample=None):
+        super().__init__(daemon=True)
+
+        self.history = history
+        self.on_sample = on_sample
+        self.new_sample = threading.Event()
+        self.stopped = threading.Event()
+        self.exception = None
+
+    def run(self):
+        try:
+            first = True
+            while not self.stopped.is_set():
+                for tl in self.history.timelines:
+                    tl.wait_until_ready()
+                for tl in self.history.timelines:
+                    tl.next()
+
+                if first:
+                    first = False
+                    continue
+
+                self.history.add()
+                if self.on_sample:
+                    self.on_sample(self.history.timelines)
+                self.new_sample.set()
+        except Exception as e:
+            self.exception = e
+            self.new_sample.set()
+
+class Tui(object):
+    """Interactive display of the history of every metric as a
+    sparkline, one collapsible panel per timeline and device.
+
+    Keys: up/down (or k/j) select a panel, enter toggles it, p pauses,
+    +/- zoom the time window out and in, q quits."""
+
+    label_width = 30
+    value_width = 14
+
+    def __init__(self, history, period, header=""):
+        self.history = history
+        self.period = period
+        self.header = header
+        self.zoom = 0
+        self.paused = False
+        self.paused_at = 0
+        self.selected = 0
+        self.top = 0
+        self.quit = False
+
+    def window(self, width):
+        secs = width * zoom_levels[self.zoom] * self.period
+        if secs >= 3600:
+            return "{:.1f}h".format(secs / 3600)
+        if secs >= 60:
+            return "{:.0f}m".format(secs / 60)
+        return "{:.0f}s".format(secs)
+
+    def key(self, k):
+        groups = len(self.history.groups)
+
+        if k in ("q", "Q"):
+            self.quit = True
+        elif k in ("p", " "):
+            self.paused = not self.paused
+            self.paused_at = self.history.count
+        elif k in ("+", "="):
+            self.zoom = min(self.zoom + 1, len(zoom_levels) - 1)
+        elif k in ("-", "_"):
+            self.zoom = max(self.zoom - 1, 0)
+        elif k in ("k", "\x1b[A"):
+            self.selected = max(self.selected - 1, 0)
+        elif k in ("j", "\x1b[B"):
+            self.selected = min(self.selected + 1, max(groups - 1, 0))
+        elif k in ("\r", "\n", "t") and groups:
+            g = list(self.history.groups.values())[self.selected]
+            g.expanded = not g.expanded
+
+    def lines(self, size):
+        spark_width = max(size.columns - self.label_width -
+                          self.value_width - 4, 10)
+        per_cell = zoom_levels[self.zoom]
+
+        head = ["{}{c.bold}{}  period {}s  window {}{}{c.rst}".
+                format(self.header, time.strftime("%H:%M:%S"), self.period,
+                       self.window(spark_width),
+                       "  [paused]" if self.paused else "", c=colours),
+                "keys: up/down select  enter toggle  p pause  "
+                "+/- zoom  q quit", ""]
+
+        body = []
+        selected_row = 0
+        with self.history.lock:
+            # While paused keep showing the window from when it was paused
+            skip = self.history.count - self.paused_at if self.paused else 0
+            shown = spark_width * per_cell
+
+            for i, g in enumerate(self.history.groups.values()):
+                if i == self.selected:
+                    selected_row = len(body)
+
+                mark = "-" if g.expanded else "+"
+                title = "{} {}".format(mark, g.name)
+                if i == self.selected:
+                    title = "{c.bold}{}{c.rst}".format("> " + title,
+                                                        c=colours)
+                else:
+                    title = "  " + title
+                body.append(title)
+
+                if not g.expanded:
+                    continue
+
+                for name, buf in g.metrics.items():
+                    # Samples from before the pause that have since been
+                    # overwritten are left out rather than shifting the
+                    # window to the oldest ones kept
+                    n = max(min(shown, len(buf.data) - skip), 0)
+                    values = buf.last(n + skip)[:n]
+                    label = name.rpartition(":")[2]
+                    value = values[-1] if len(values) else math.nan
+                    value = ("-" if math.isnan(value) else
+                             agent.format_value(name, value))
+
+                    body.append("    {:<{}.{}} {:>{}}  {}".
+                                format(label, self.label_width - 4,
+                                       self.label_width - 4,
+                                       value, self.value_width,
+                                       sparkline(values, spark_width,
+                                                 per_cell)))
+
+        # Scroll so the selected panel's title stays in view
+        rows = max(size.lines - len(head), 1)
+        if selected_row < self.top:
+            self.top = selected_row
+        elif selected_row >= self.top + rows:
+            self.top = selected_row - rows + 1
+        self.top = max(min(self.top, max(len(body) - rows, 0)), 0)
+
+        return head + body[self.top:self.top + rows]
+
+    def draw(self, screen):
+        for l in self.lines(shutil.get_terminal_size()):
+            screen.write(l + "\n")
+        screen.render()
+
+    def _read_keys(self, fd, timeout):
+        r, _, _ = select.select([fd], [], [], timeout)
+        if not r:
+            return []
+
+        data = os.read(fd, 64).decode(errors="replace")
+        keys = []
+        while data:
+            if data.startswith("\x1b[") and len(data) >= 3:
+                keys.append(data[:3])
+                data = data[3:]
+            else:
+                keys.append(data[0])
+                data = data[1:]
+
+        return keys
+
+    def run(self, sampler, runtime=0):
+        fd = sys.stdin.fileno()
+        old = termios.tcgetattr(fd)
+        start_time = time.time()
+
+        try:
+            tty.setcbreak(fd)
+
+            with utils.CursesContext() as scr:
+                screen = utils.ScreenBuffer(scr)
+                self.draw(screen)
+
+                while not self.quit:
+                    if runtime > 0 and time.time() - start_time >= runtime:
+                        break
+
+                    keys = self._read_keys(fd, 0.1)
+                    for k in keys:
+                        self.key(k)
+
+                    if sampler.exception:
+                        raise sampler.exception
+
+                    new = sampler.new_sample.is_set()
+                    sampler.new_sample.clear()
+                    if keys or (new and not self.paused):
+                        self.draw(screen)
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old)
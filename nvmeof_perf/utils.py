@@ -17,7 +17,10 @@
 
 import sys
 import time
+import bisect
 import curses
+import shutil
+import threading
 
 class DummyContext(object):
     def __enter__(self):
@@ -47,19 +50,166 @@ class Timeline(DummyContext):
         self.first = False
         self.last_time = time.time()
 
+class TimelineRecorder(threading.Thread):
+    """Sample a set of timelines in the background until stopped. The
+    first sample of each timeline only establishes the starting counters
+    so it isn't recorded."""
+
+    def __init__(self, timelines, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.daemon = True
+
+        self.timelines = timelines
+        self.titles = None
+        self.samples = []
+        self.stopped = threading.Event()
+        self.exception = None
+
+    def run(self):
+        try:
+            first = True
+            while not self.stopped.is_set():
+                for tl in self.timelines:
+                    tl.next()
+
+                if first:
+                    first = False
+                    continue
+
+                self.samples.append([time.time()] +
+                                    [x for tl in self.timelines
+                                     for x in tl.csv()])
+                if self.titles is None:
+                    self.titles = [t for tl in self.timelines
+                                   for t in tl.csv_titles()]
+        except Exception as e:
+            self.exception = e
+
+    def __enter__(self):
+        for tl in self.timelines:
+            tl.__enter__()
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stopped.set()
+        self.join()
+        for tl in self.timelines:
+            tl.__exit__(type, value, traceback)
+
+        if self.exception and type is None:
+            raise self.exception
+
+    def results(self, phases=[]):
+        """Return the recorded samples, each tagged with the most recent
+        of the given (timestamp, phase) marks at the time it was taken."""
+
+        phases = sorted(phases)
+        times = [t for t, p in phases]
+
+        samples = []
+        for s in self.samples:
+            i = bisect.bisect_right(times, s[0])
+            samples.append([s[0], phases[i - 1][1] if i else None] + s[1:])
+
+        return {"titles": ["timestamp", "phase"] + (self.titles or []),
+                "phases": phases,
+                "samples": samples}
+
+def estimate_clock_offset(samples):
+    """Estimate how far a remote clock is ahead of the local one from
+    (local send time, remote time, local receive time) exchanges. The
+    exchange with the shortest round trip bounds the error best."""
+
+    t0, remote, t1 = min(samples, key=lambda s: s[2] - s[0])
+    return remote - (t0 + t1) / 2, t1 - t0
+
 class CursesContext(object):
     def __enter__(self):
         curses.setupterm()
         self.cmd("smcup")
+        # Truncate long lines instead of wrapping them so each line of
+        # output stays on one row of the screen
+        self.cmd("rmam")
         return self
 
     def __exit__(self, type, value, traceback):
+        self.cmd("smam")
         self.cmd("rmcup")
+        self.flush()
 
     def cmd(self, name, *args):
         s = curses.tigetstr(name)
+        if s is None:
+            return
         sys.stdout.buffer.write(curses.tparm(s, *args))
 
+    def write(self, text):
+        sys.stdout.buffer.write(text.encode())
+
+    def flush(self):
+        sys.stdout.buffer.flush()
+
+    def move(self, row, col=0):
+        self.cmd("cup", row, col)
+
     def clear(self):
         self.cmd("clear")
         self.cmd("cup", 0, 0)
+
+def _unchanged_columns(old, new):
+    """Number of leading characters of new that are already on screen
+    from old, stopping at any escape code or tab as past those the
+    string index no longer matches the screen column."""
+
+    n = 0
+    for a, b in zip(old, new):
+        if a != b or a in "\x1b\t":
+            break
+        n += 1
+
+    return n
+
+class ScreenBuffer(object):
+    """File-like object that collects one frame of output and, on
+    render(), rewrites only the lines that changed since the previous
+    frame, starting from the first changed column."""
+
+    def __init__(self, scr):
+        self.scr = scr
+        self.frame = []
+        self.lines = []
+        self.size = None
+
+    def write(self, data):
+        self.frame.append(data)
+
+    def flush(self):
+        pass
+
+    def render(self):
+        size = shutil.get_terminal_size()
+        if size != self.size:
+            self.size = size
+            self.lines = []
+            self.scr.clear()
+
+        lines = "".join(self.frame).split("\n")[:size.lines]
+        self.frame = []
+
+        for i, line in enumerate(lines):
+            old = self.lines[i] if i < len(self.lines) else ""
+            if line == old and i < len(self.lines):
+                continue
+
+            col = _unchanged_columns(old, line)
+            self.scr.move(i, col)
+            self.scr.write(line[col:])
+            self.scr.cmd("el")
+
+        if len(lines) < len(self.lines):
+            self.scr.move(len(lines))
+            self.scr.cmd("ed")
+
+        self.lines = lines
+        self.scr.flush()
@@ -31,5 +31,5 @@ setup(name='nvmeof_perf',
       author_email='logang@deltatee.com',
       url='https://github.com/Eideticom/nvmeof-perf',
       packages=['nvmeof_perf'],
-      scripts=['nvmeof-perf', 'rdma-perf'],
+      scripts=['nvmeof-perf', 'rdma-perf', 'blk-perf', 'nvmeof-merge'],
 )